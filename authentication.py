@@ -0,0 +1,81 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+USER_CACHE_TIMEOUT = 30
+REVOCATION_TIMEOUT = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+
+_auth_cache = None
+
+
+def auth_cache():
+    # Holds revocation marks and briefly cached User rows. Defaults to a
+    # private local-memory cache; set SWEETSHOP_AUTH_CACHE to a shared CACHES
+    # alias so a revocation reaches every worker process.
+    global _auth_cache
+    if _auth_cache is None:
+        alias = getattr(settings, 'SWEETSHOP_AUTH_CACHE', None)
+        _auth_cache = caches[alias] if alias else LocMemCache('sweetshop-auth', {})
+    return _auth_cache
+
+
+class SweetShopRefreshToken(RefreshToken):
+    # Access tokens copy these claims from the refresh token, so requests can
+    # be authorized from the token alone. auth_time survives token refreshes
+    # (unlike iat), which is what revocation is checked against. Unlike iat
+    # it keeps sub-second precision, so a token issued just after a
+    # revocation in the same second is still told apart from one before it.
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['username'] = user.get_username()
+        token['is_staff'] = user.is_staff
+        token['auth_time'] = time.time()
+        return token
+
+
+class ClaimsUser(TokenUser):
+    @cached_property
+    def user(self):
+        """The full User row, for the rare code path that really needs one."""
+        key = f'sweetshop:user:{self.id}'
+        user = auth_cache().get(key)
+        if user is None:
+            user = get_user_model()._default_manager.get(**{api_settings.USER_ID_FIELD: self.id})
+            auth_cache().set(key, user, USER_CACHE_TIMEOUT)
+        return user
+
+
+def revoke_user_tokens(user_id):
+    """Reject every token issued to `user_id` before now and drop its cached User."""
+    cache = auth_cache()
+    cache.set(f'sweetshop:revoked:{user_id}', time.time(), REVOCATION_TIMEOUT)
+    cache.delete(f'sweetshop:user:{user_id}')
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    # Builds request.user from the token claims instead of loading the User
+    # row on every request. The only per-request lookup is the revocation
+    # mark, which lives in the (in-process by default) auth cache.
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        revoked_at = auth_cache().get(f'sweetshop:revoked:{user_id}')
+        # Tokens without a fractional auth_time count as issued at the start
+        # of their second, so one from the second of a revocation is rejected.
+        issued_at = validated_token.get('auth_time', validated_token.get('iat', 0))
+        if revoked_at is not None and issued_at <= revoked_at:
+            raise InvalidToken('Token has been revoked')
+        return ClaimsUser(validated_token)
@@ -0,0 +1,132 @@
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+VERSION_KEY = 'sweetshop:catalog:version'
+DEFAULT_TIMEOUT = 300
+DEFAULT_MAX_ENTRIES = 10000
+CACHE_WARNING = (
+    'SWEETSHOP_CATALOG_CACHE is not a shared cache backend, so this process cannot invalidate what web '
+    'workers have cached: they serve the old stock until their cached pages expire.'
+)
+
+
+class CatalogCache:
+    """Read-through cache for serialized catalog responses.
+
+    Keys embed a catalog version token that every write replaces, so a write
+    invalidates all cached pages at once without enumerating them. The
+    backend is the CACHES alias named by SWEETSHOP_CATALOG_CACHE; without it
+    a private, LRU-evicting local-memory cache is used. Each worker process
+    then has its own version, so multi-process deployments should point the
+    setting at a shared backend.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            alias = getattr(settings, 'SWEETSHOP_CATALOG_CACHE', None)
+            if alias:
+                self._backend = caches[alias]
+            else:
+                self._backend = LocMemCache('sweetshop-catalog', {
+                    'TIMEOUT': DEFAULT_TIMEOUT,
+                    'OPTIONS': {'MAX_ENTRIES': DEFAULT_MAX_ENTRIES},
+                })
+        return self._backend
+
+    def version(self):
+        version = self.backend.get(VERSION_KEY)
+        if version is None:
+            # A random token rather than a counter: if the version key is ever
+            # evicted, restarting from a fixed value could resurrect old pages.
+            self.backend.add(VERSION_KEY, uuid.uuid4().hex, None)
+            version = self.backend.get(VERSION_KEY)
+        return version
+
+    @property
+    def process_local(self):
+        # True when other processes cannot see this cache, so writes made here
+        # do not invalidate what web workers have cached.
+        return isinstance(self.backend, LocMemCache)
+
+    def bump(self):
+        self.backend.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+    def invalidate(self):
+        self.bump()
+        # While the writer's transaction is open a reader can still cache the
+        # old rows under the new version, so bump once more after commit.
+        if connection.in_atomic_block:
+            transaction.on_commit(self.bump)
+
+    def key(self, scope, *parts):
+        # The digest covers the version, so it doubles as a strong ETag.
+        payload = '\n'.join(str(part) for part in (self.version(), scope, *parts))
+        return f'sweetshop:catalog:{scope}:{hashlib.sha1(payload.encode()).hexdigest()}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'version': self.version(),
+            'backend': type(self.backend).__name__,
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+class CachedCatalogMixin:
+    # Caches the serialized body of successful GETs. Authentication and
+    # permission checks still run on every request (they happen in
+    # initial(), before get()), only the query and serialization are skipped.
+    # Subclasses with no cache_scope (the benchmarks) always hit the database.
+    cache_scope = None
+
+    def get(self, request, *args, **kwargs):
+        if self.cache_scope is None:
+            return super().get(request, *args, **kwargs)
+        key = catalog_cache.key(self.cache_scope, request.accepted_media_type, request.build_absolute_uri())
+        etag = quote_etag(key.rsplit(':', 1)[-1])
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = catalog_cache.get(key)
+        if data is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            catalog_cache.set(key, response.data)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
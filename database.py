@@ -0,0 +1,116 @@
+from contextvars import ContextVar
+
+import django
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+MMAP_SIZE = 256 * 1024 * 1024
+BUSY_TIMEOUT = 20
+# Settings key holding the PRAGMAs on Django versions without init_command.
+INIT_COMMAND = 'SWEETSHOP_INIT_COMMAND'
+
+_read_alias = ContextVar('sweetshop_read_alias', default=None)
+
+
+def sqlite_databases(name, read_alias='replica', timeout=BUSY_TIMEOUT, mmap_size=MMAP_SIZE):
+    """DATABASES for several worker processes sharing one SQLite file.
+
+    Every new connection switches to WAL (readers no longer block on the
+    writer), relaxes fsync to synchronous=NORMAL (safe in WAL mode), waits up
+    to `timeout` seconds on a locked database instead of failing, and maps
+    the file into memory. Connections are kept open between requests.
+
+    `read_alias` is a query-only connection to the same file for
+    ReadReplicaRouter; pass None to leave it out.
+    """
+    pragmas = [
+        'PRAGMA synchronous=NORMAL',
+        f'PRAGMA mmap_size={mmap_size}',
+        'PRAGMA temp_store=MEMORY',
+    ]
+    primary = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'timeout': timeout},
+    }
+    set_init_command(primary, '; '.join(['PRAGMA journal_mode=WAL', *pragmas]))
+    if django.VERSION >= (5, 1):
+        # Take the write lock when the transaction starts. A deferred
+        # transaction that reads and then writes cannot wait out the busy
+        # timeout on the upgrade and fails with "database is locked".
+        primary['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+    databases = {DEFAULT_DB_ALIAS: primary}
+    if read_alias:
+        replica = {
+            **primary,
+            'OPTIONS': {'timeout': timeout},
+            'TEST': {'MIRROR': DEFAULT_DB_ALIAS},
+        }
+        set_init_command(replica, '; '.join([*pragmas, 'PRAGMA query_only=ON']))
+        databases[read_alias] = replica
+    return databases
+
+
+def set_init_command(database, sql):
+    """Run `sql` on every new connection of a sqlite3 DATABASES entry.
+
+    The init_command option only exists from Django 5.1 (older versions
+    pass it on to sqlite3.connect(), which rejects it); before that the SQL
+    is kept under INIT_COMMAND and run by run_init_command().
+    """
+    database.pop(INIT_COMMAND, None)
+    database['OPTIONS'].pop('init_command', None)
+    if django.VERSION >= (5, 1):
+        database['OPTIONS']['init_command'] = sql
+    else:
+        database[INIT_COMMAND] = sql
+
+
+def run_init_command(connection):
+    sql = connection.settings_dict.get(INIT_COMMAND)
+    if not sql or connection.vendor != 'sqlite':
+        return
+    for statement in sql.split(';'):
+        if statement.strip():
+            connection.connection.execute(statement)
+
+
+def read_alias():
+    return getattr(settings, 'SWEETSHOP_READ_DATABASE', None)
+
+
+class ReadReplicaMiddleware:
+    """Route the ORM reads of GET/HEAD/OPTIONS requests to the read alias.
+
+    Writes, and every query of an unsafe request, stay on the primary so a
+    request always reads its own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        alias = read_alias() if request.method in ('GET', 'HEAD', 'OPTIONS') else None
+        token = _read_alias.set(alias)
+        try:
+            return self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == read_alias():
+            return False
+        return None
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+import zlib
+
+EXPORT_CHUNK_SIZE = 2000
+FLUSH_BYTES = 64 * 1024
+
+
+def buffered(lines, flush_bytes=FLUSH_BYTES):
+    # The first line goes out on its own so the client sees bytes as soon as
+    # the query returns; after that lines are sent in ~64 KiB chunks.
+    buffer = []
+    size = 0
+    first = True
+    for line in lines:
+        data = line.encode()
+        if first:
+            yield data
+            first = False
+            continue
+        buffer.append(data)
+        size += len(data)
+        if size >= flush_bytes:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_ndjson(rows, serializer):
+    for row in rows:
+        yield json.dumps(serializer.to_representation(row), ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def iter_csv(rows, serializer):
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    def render(values):
+        line.seek(0)
+        line.truncate()
+        writer.writerow(values)
+        return line.getvalue()
+
+    yield render(serializer.fields)
+    for row in rows:
+        data = serializer.to_representation(row)
+        # Nested values (the image variant URLs) go in as a JSON cell.
+        yield render([json.dumps(data[name]) if isinstance(data[name], dict) else data[name]
+                      for name in serializer.fields])
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        # Sync-flush each chunk so compression never holds data back.
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+EXPORT_FORMATS = {
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+}
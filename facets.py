@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, IntegerField, Value, When
+from rest_framework.exceptions import ValidationError
+
+from .caching import catalog_cache
+from .models import Sweet
+from .search import filter_sweets
+
+FACETS = ('category', 'price')
+FILTER_PARAMS = ('q', 'name', 'category', 'min_price', 'max_price')
+# Upper bounds of the price histogram buckets; the last bucket is open-ended.
+PRICE_EDGES = (Decimal('1'), Decimal('2'), Decimal('5'), Decimal('10'), Decimal('20'), Decimal('50'))
+
+
+def parse_facets(value):
+    if not value:
+        return []
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in FACETS]
+    if unknown:
+        raise ValidationError({'facets': [f"Unknown facet(s): {', '.join(unknown)}"]})
+    return [name for name in FACETS if name in requested]
+
+
+def without(params, *names):
+    # Each facet ignores its own filter, so the sidebar can still offer the
+    # other categories or price ranges.
+    return {key: params.get(key) for key in FILTER_PARAMS if key not in names}
+
+
+def category_facet(params):
+    queryset = filter_sweets(Sweet.objects.all(), without(params, 'category'))
+    counts = dict(queryset.order_by().values_list('category').annotate(count=Count('id')))
+    return [
+        {'value': value, 'label': label, 'count': counts.get(value, 0)}
+        for value, label in Sweet.CATEGORY_CHOICES
+    ]
+
+
+def price_facet(params):
+    queryset = filter_sweets(Sweet.objects.all(), without(params, 'min_price', 'max_price'))
+    bucket = Case(
+        *[When(price__lt=edge, then=Value(index)) for index, edge in enumerate(PRICE_EDGES)],
+        default=Value(len(PRICE_EDGES)),
+        output_field=IntegerField(),
+    )
+    counts = dict(queryset.order_by().annotate(bucket=bucket).values_list('bucket').annotate(count=Count('id')))
+    bounds = [None, *PRICE_EDGES, None]
+    return [
+        {
+            'min': None if lower is None else f'{lower:.2f}',
+            'max': None if upper is None else f'{upper:.2f}',
+            'count': counts.get(index, 0),
+        }
+        for index, (lower, upper) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+FACET_BUILDERS = {
+    'category': category_facet,
+    'price': price_facet,
+}
+
+
+def sweet_facets(params, names):
+    """Counts for the requested facets under the current search filters.
+
+    Cached per filter combination, independent of the page being viewed;
+    any catalog write invalidates them with the rest of the catalog cache.
+    """
+    key = catalog_cache.key('facets', *names, *(f'{param}={params.get(param) or ""}' for param in FILTER_PARAMS))
+    facets = catalog_cache.get(key)
+    if facets is None:
+        facets = {name: FACET_BUILDERS[name](params) for name in names}
+        catalog_cache.set(key, facets)
+    return facets
@@ -0,0 +1,243 @@
+import base64
+import itertools
+import json
+import queue
+import threading
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.renderers import BaseRenderer
+
+from .models import StockShard, Sweet, SweetTombstone
+from .serializers import SweetValuesSerializer
+
+FEED_LIMIT = 500
+MAX_FEED_LIMIT = 5000
+# Timestamps are taken before a writer gets the database lock, so a write may
+# commit up to this long after its updated_at. It covers the busy timeout of
+# the SQLite profile plus the transaction itself.
+FEED_LAG_SECONDS = 30
+TOMBSTONE_RETENTION_DAYS = 30
+
+
+def feed_lag():
+    return timedelta(seconds=getattr(settings, 'SWEETSHOP_FEED_LAG_SECONDS', FEED_LAG_SECONDS))
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'SWEETSHOP_TOMBSTONE_RETENTION_DAYS', TOMBSTONE_RETENTION_DAYS))
+
+
+class WatermarkExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The watermark is older than the deletion history; resync from the full catalog.'
+    default_code = 'watermark_expired'
+
+
+def encode_watermark(updated, deleted, sharded=None):
+    payload = json.dumps({'u': updated, 'd': deleted, 's': sharded}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_watermark(token):
+    # A watermark is three (timestamp, id) positions: the last changed sweet,
+    # the last tombstone and the last stock shard write the client has seen.
+    # Watermarks from before shards were tracked have no 's'.
+    if not token:
+        return None, None, None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return [parse_position(payload[key]) for key in ('u', 'd')] + [parse_position(payload.get('s'))]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise ValidationError({'since': ['Invalid watermark']})
+
+
+def parse_position(position):
+    if position is None:
+        return None
+    timestamp, pk = position
+    timestamp = datetime.fromisoformat(timestamp)
+    # Issued watermarks always carry an offset; a naive one was not issued
+    # here and cannot be compared with the aware timestamps in the database.
+    if timezone.is_naive(timestamp):
+        raise ValueError(position)
+    return timestamp, int(pk)
+
+
+def after(queryset, field, position):
+    if position is None:
+        return queryset
+    timestamp, pk = position
+    return queryset.filter(Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk}))
+
+
+def read_page(queryset, field, position, cutoff, limit):
+    """Up to `limit` rows after `position` in (field, id) order.
+
+    Returns the rows, the position to resume from and whether more rows
+    are ready. Rows newer than `cutoff` are returned but never moved past:
+    a write still committing with an earlier timestamp would be skipped.
+    """
+    rows = list(after(queryset, field, position).order_by(field, 'id')[:limit + 1])
+    more, rows = len(rows) > limit, rows[:limit]
+    if more and rows[-1][field] <= cutoff:
+        return rows, (rows[-1][field], rows[-1]['id']), True
+    # Caught up, or only unsettled rows are left: resume from the cutoff and
+    # send rows after it again next time.
+    resume = (cutoff, 0)
+    if position is not None and position > resume:
+        resume = position
+    return rows, resume, False
+
+
+def change_feed(since, limit=FEED_LIMIT, fields=None, now=None):
+    """Sweets changed and deleted after the `since` watermark, plus the next watermark.
+
+    Changes from the last feed_lag() are repeated by the next call, so
+    clients dedupe on (id, updated_at).
+    """
+    updated_position, deleted_position, shard_position = decode_watermark(since)
+    now = now or timezone.now()
+    # Tombstones older than the retention are pruned, so a client that last
+    # synced before then may have missed deletions.
+    oldest = deleted_position or updated_position
+    if oldest is not None and oldest[0] < now - tombstone_retention():
+        raise WatermarkExpired()
+
+    cutoff = now - feed_lag()
+    serializer = SweetValuesSerializer(fields)
+    changed, updated_position, more_changed = read_page(
+        serializer.values(Sweet.objects.all(), 'id', 'updated_at'),
+        'updated_at', updated_position, cutoff, limit,
+    )
+    deleted, deleted_position, more_deleted = read_page(
+        SweetTombstone.objects.values('id', 'sweet_id', 'deleted_at'),
+        'deleted_at', deleted_position, cutoff, limit,
+    )
+    # Sharded purchases and restocks write only the shard rows. Their sweets
+    # are reported too, with the latest shard write as updated_at.
+    shards, shard_position, more_shards = read_page(
+        StockShard.objects.values('id', 'sweet_id', 'updated_at'),
+        'updated_at', shard_position, cutoff, limit,
+    )
+    touched = {}
+    for shard in shards:
+        touched[shard['sweet_id']] = max(shard['updated_at'], touched.get(shard['sweet_id'], shard['updated_at']))
+    missing = touched.keys() - {row['id'] for row in changed}
+    if missing:
+        changed += serializer.values(Sweet.objects.filter(pk__in=missing), 'id', 'updated_at')
+    for row in changed:
+        row['updated_at'] = max(row['updated_at'], touched.get(row['id'], row['updated_at']))
+    changed.sort(key=lambda row: (row['updated_at'], row['id']))
+
+    watermark = encode_watermark(*[[position[0].isoformat(), position[1]]
+                                   for position in (updated_position, deleted_position, shard_position)])
+    return {
+        'changes': serializer.many(changed),
+        'deleted': [tombstone['sweet_id'] for tombstone in deleted],
+        'watermark': watermark,
+        'has_more': more_changed or more_deleted or more_shards,
+    }
+
+
+def prune_tombstones(now=None):
+    """Delete tombstones older than the retention; returns how many."""
+    now = now or timezone.now()
+    return SweetTombstone.objects.filter(deleted_at__lt=now - tombstone_retention()).delete()[0]
+
+
+class EventStreamRenderer(BaseRenderer):
+    # Lets DRF negotiate Accept: text/event-stream. The stream itself is a
+    # StreamingHttpResponse, so this only renders error responses.
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f'event: error\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+class Subscriber:
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = False
+
+
+class StockBroadcaster:
+    """In-process fan-out of stock change events to SSE clients.
+
+    Each subscriber gets a bounded queue. A subscriber whose queue is full
+    is dropped rather than allowed to slow down publishers or grow without
+    bound; it is told so and is expected to resync from the change feed.
+    Events only reach clients connected to the same worker process.
+    """
+
+    def __init__(self, max_queue=100, max_subscribers=100):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(self.max_queue)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        event = {'event_id': next(self._ids), **event}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+
+    def publish_stock(self, sweet):
+        self.publish({
+            'id': sweet.pk,
+            'quantity': sweet.total_quantity,
+            'available': sweet.available_quantity,
+            'updated_at': sweet.updated_at.isoformat(),
+        })
+
+    def publish_stock_many(self, sweets):
+        # One query for a whole queryset of sweets, skipped when nobody is
+        # listening.
+        if not self._subscribers:
+            return
+        rows = sweets.with_stock().values_list('pk', 'stock', 'available', 'updated_at')
+        for pk, stock, available, updated_at in rows.iterator():
+            self.publish({'id': pk, 'quantity': stock, 'available': available, 'updated_at': updated_at.isoformat()})
+
+    def stream(self, subscriber, heartbeat=15):
+        """Yield Server-Sent Events for `subscriber` until it is dropped or the client goes away."""
+        try:
+            yield 'retry: 3000\n\n'
+            while not subscriber.dropped:
+                try:
+                    event = subscriber.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                data = json.dumps({key: value for key, value in event.items() if key != 'event_id'})
+                yield f"id: {event['event_id']}\nevent: stock\ndata: {data}\n\n"
+            yield 'event: dropped\ndata: {}\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+
+broadcaster = StockBroadcaster()
@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+
+WORKERS = 2
+MAX_PENDING = 8
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingPool:
+    """Bounded pool for password hashing (PBKDF2 and friends).
+
+    At most `workers` hashes run at once and at most `max_pending` more may
+    wait; anything beyond that raises HashingBusy straight away instead of
+    queueing, so a login storm cannot tie up every request thread or eat
+    all the CPU that catalog reads need. hashlib releases the GIL while it
+    hashes, so the other request threads keep running meanwhile.
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='sweetshop-hashing')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        return future.result()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hashing_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(
+                    getattr(settings, 'SWEETSHOP_HASH_WORKERS', WORKERS),
+                    getattr(settings, 'SWEETSHOP_HASH_QUEUE', MAX_PENDING),
+                )
+    return _pool
+
+
+def hash_password(raw_password):
+    return hashing_pool().run(make_password, raw_password)
+
+
+def authenticate_user(username, password):
+    """Like ModelBackend.authenticate, with only the hashing done in the pool.
+
+    Database access stays on the calling thread, inside its connection and
+    transaction.
+    """
+    user_model = get_user_model()
+    try:
+        user = user_model._default_manager.get_by_natural_key(username)
+    except user_model.DoesNotExist:
+        # Hash anyway so unknown usernames take as long as wrong passwords.
+        hash_password(password)
+        return None
+    if not hashing_pool().run(check_password, password, user.password):
+        return None
+    if not user.is_active:
+        return None
+    preferred = get_hasher('default')
+    if identify_hasher(user.password).algorithm != preferred.algorithm or preferred.must_update(user.password):
+        # Upgrade the stored hash the way check_password's setter would,
+        # without save() signals: the password itself has not changed.
+        user.password = hash_password(password)
+        user_model._default_manager.filter(pk=user.pk).update(password=user.password)
+    return user
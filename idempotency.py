@@ -0,0 +1,139 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+RESPONSE_TIMEOUT = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+# How long a retry waits for the original request before giving up with 409,
+# and how long a crashed worker's claim on a key can block it.
+WAIT_TIMEOUT = 10
+CLAIM_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+
+
+class IdempotencyStore:
+    """Stored responses for requests sent with an Idempotency-Key header.
+
+    Responses are kept per user and key for RESPONSE_TIMEOUT in the CACHES
+    alias named by SWEETSHOP_IDEMPOTENCY_CACHE, or a private bounded
+    local-memory cache. Concurrent requests with the same key are coalesced:
+    only the first one runs, the others wait for and replay its response.
+    Waiters in the same process block on an event; across processes an
+    add()-based claim in the backend keeps a second worker from running it.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            alias = getattr(settings, 'SWEETSHOP_IDEMPOTENCY_CACHE', None)
+            if alias:
+                self._backend = caches[alias]
+            else:
+                self._backend = LocMemCache('sweetshop-idempotency', {
+                    'TIMEOUT': RESPONSE_TIMEOUT,
+                    'OPTIONS': {'MAX_ENTRIES': DEFAULT_MAX_ENTRIES},
+                })
+        return self._backend
+
+    def run(self, key, fingerprint, view):
+        stored = self.backend.get(key)
+        if stored is not None:
+            return replay(stored, fingerprint)
+
+        with self._lock:
+            done = self._in_flight.get(key)
+            leader = done is None
+            if leader:
+                done = self._in_flight[key] = threading.Event()
+        if not leader:
+            done.wait(WAIT_TIMEOUT)
+            return self.wait_for(key, fingerprint, deadline=time.monotonic())
+
+        claim = f'{key}:claim'
+        try:
+            if not self.backend.add(claim, fingerprint, CLAIM_TIMEOUT):
+                return self.wait_for(key, fingerprint, deadline=time.monotonic() + WAIT_TIMEOUT)
+            try:
+                response = view()
+                # Server errors are not final; let the client retry them.
+                if response.status_code < 500:
+                    self.backend.set(key, {
+                        'fingerprint': fingerprint,
+                        'status': response.status_code,
+                        'data': response.data,
+                    }, RESPONSE_TIMEOUT)
+                return response
+            finally:
+                self.backend.delete(claim)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            done.set()
+
+    def wait_for(self, key, fingerprint, deadline):
+        while True:
+            stored = self.backend.get(key)
+            if stored is not None:
+                return replay(stored, fingerprint)
+            if time.monotonic() >= deadline:
+                return Response(
+                    {'error': 'A request with this Idempotency-Key is still in progress'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            time.sleep(POLL_INTERVAL)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'error': 'Idempotency-Key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(stored['data'], status=stored['status'], headers={'Idempotent-Replayed': 'true'})
+
+
+idempotency_store = IdempotencyStore()
+
+
+def idempotent(scope):
+    """Make a function-based API view replay its response for a repeated Idempotency-Key.
+
+    Goes below @permission_classes so authentication has already run.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            raw_key = request.headers.get(HEADER)
+            if raw_key is None:
+                return view(request, *args, **kwargs)
+            if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+                return Response(
+                    {'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            digest = hashlib.sha256(raw_key.encode()).hexdigest()
+            key = f'sweetshop:idempotency:{request.user.id}:{scope}:{digest}'
+            fingerprint = hashlib.sha256(json.dumps(
+                [request.method, request.path, request.data], sort_keys=True, default=str,
+            ).encode()).hexdigest()
+            return idempotency_store.run(key, fingerprint, lambda: view(request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,193 @@
+import hashlib
+import io
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import close_old_connections
+from django.urls import reverse
+from django.utils import timezone
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; uploads are refused without it.
+    Image = ImageOps = None
+
+from .caching import catalog_cache
+from .models import Sweet
+
+logger = logging.getLogger('api.images')
+
+# Longest side in pixels. The size is part of every file name, so changing
+# one here produces new names instead of stale cached files.
+VARIANTS = {
+    'thumb': 160,
+    'card': 480,
+    'full': 1200,
+}
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+DIGEST_LENGTH = 32
+NAME_RE = re.compile(r'^sweets/[0-9a-f]{2}/[0-9a-f]{%d}-[a-z]+\d+\.(webp|jpeg)$' % DIGEST_LENGTH)
+
+
+class ImageError(Exception):
+    pass
+
+
+class ImageSupportMissing(ImageError):
+    pass
+
+
+def image_storage():
+    return storages[getattr(settings, 'SWEETSHOP_IMAGE_STORAGE', 'default')]
+
+
+def content_digest(data):
+    return hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]
+
+
+def variant_name(digest, variant, fmt):
+    return f'sweets/{digest[:2]}/{digest}-{variant}{VARIANTS[variant]}.{fmt}'
+
+
+def variant_urls(digest):
+    """URLs of every variant of an image, keyed by variant then format."""
+    if not digest:
+        return None
+    prefix = reverse('sweet-image-file', args=['sweets/'])
+    return {
+        variant: {fmt: prefix + variant_name(digest, variant, fmt)[len('sweets/'):] for fmt in FORMATS}
+        for variant in VARIANTS
+    }
+
+
+def is_processed(digest):
+    storage = image_storage()
+    return all(storage.exists(variant_name(digest, variant, fmt)) for variant in VARIANTS for fmt in FORMATS)
+
+
+def open_image(data):
+    if Image is None:
+        raise ImageSupportMissing('Image uploads need Pillow installed')
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as exc:
+        raise ImageError(f'Not a readable image: {exc}')
+    return ImageOps.exif_transpose(image)
+
+
+def render_variants(image, digest):
+    storage = image_storage()
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for fmt, (pil_format, _, options) in FORMATS.items():
+            name = variant_name(digest, variant, fmt)
+            if storage.exists(name):
+                continue
+            frame = resized
+            if pil_format == 'JPEG' and frame.mode != 'RGB':
+                frame = flatten(frame)
+            buffer = io.BytesIO()
+            frame.save(buffer, pil_format, **options)
+            storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def flatten(image):
+    # JPEG has no alpha channel: composite onto white instead of black.
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def attach(sweet_id, digest):
+    Sweet.objects.filter(pk=sweet_id).update(
+        image_hash=digest,
+        image=variant_urls(digest)['full']['jpeg'],
+        updated_at=timezone.now(),
+    )
+    catalog_cache.invalidate()
+
+
+def process(sweet_id, image, digest):
+    try:
+        render_variants(image, digest)
+        attach(sweet_id, digest)
+    except Exception:
+        logger.exception('Rendering image %s for sweet %s failed', digest, sweet_id)
+
+
+def in_worker(func, *args):
+    try:
+        func(*args)
+    finally:
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def submit(func, *args):
+    # SWEETSHOP_IMAGE_WORKERS = 0 renders inline, on the request thread.
+    global _executor
+    workers = getattr(settings, 'SWEETSHOP_IMAGE_WORKERS', 1)
+    if not workers:
+        func(*args)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(workers, thread_name_prefix='sweetshop-images')
+    _executor.submit(in_worker, func, *args)
+
+
+def too_large():
+    return ImageError(f'Images are limited to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB')
+
+
+def read_upload(stream):
+    """Read an upload from a file-like object, giving up once it passes MAX_UPLOAD_BYTES.
+
+    Raw request bodies are read this way rather than through request.body,
+    which DATA_UPLOAD_MAX_MEMORY_SIZE caps well below the image limit.
+    """
+    chunks = []
+    size = 0
+    while chunk := stream.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise too_large()
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def upload_image(sweet_id, data):
+    """Attach uploaded image bytes to a sweet; returns (digest, ready).
+
+    Identical bytes hash to the same names, so a repeat upload reuses the
+    variants already stored and is attached immediately.
+    """
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise too_large()
+    digest = content_digest(data)
+    if is_processed(digest):
+        attach(sweet_id, digest)
+        return digest, True
+    image = open_image(data)
+    submit(process, sweet_id, image, digest)
+    return digest, False
+
+
+def content_type(name):
+    return FORMATS[name.rsplit('.', 1)[-1]][1]
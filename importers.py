@@ -0,0 +1,183 @@
+import codecs
+import csv
+import json
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .ledger import record_stock_changes
+from .models import InventoryEvent, Sweet
+from .serializers import SweetSerializer, BulkRestockRowSerializer
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+UPSERT_FIELDS = ['description', 'category', 'price', 'quantity', 'image', 'updated_at']
+
+
+def iter_lines(stream, chunk_size=CHUNK_SIZE):
+    """Yield decoded lines (with their newline) from a byte stream, one chunk at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iter_csv_rows(stream):
+    reader = csv.DictReader(iter_lines(stream))
+    for row in reader:
+        # Empty cells fall back to the model defaults instead of failing validation.
+        yield reader.line_num, {key: value for key, value in row.items() if key and value != ''}
+
+
+def iter_ndjson_rows(stream):
+    for line_num, line in enumerate(iter_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, None
+            continue
+        yield line_num, row if isinstance(row, dict) else None
+
+
+ROW_READERS = {
+    'text/csv': iter_csv_rows,
+    'application/x-ndjson': iter_ndjson_rows,
+    'application/jsonl': iter_ndjson_rows,
+}
+
+
+class SweetImporter:
+    def __init__(self, mode='upsert', batch_size=BATCH_SIZE, user_id=None):
+        self.mode = mode
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.restocked = 0
+        self.error_count = 0
+        self.errors = []
+
+    def run(self, rows):
+        batch = []
+        for line_num, row in rows:
+            self.processed += 1
+            if row is None:
+                self.add_error(line_num, {'non_field_errors': ['Row is not a JSON object']})
+                continue
+            batch.append((line_num, row))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+        return self
+
+    def add_error(self, line_num, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line_num, 'errors': errors})
+
+    def validate(self, batch, serializer_class):
+        # One serializer instance per batch: building the field set is the
+        # expensive part of a ModelSerializer, run_validation itself is cheap.
+        serializer = serializer_class()
+        valid = []
+        for line_num, row in batch:
+            try:
+                valid.append((line_num, serializer.run_validation(row)))
+            except serializers.ValidationError as exc:
+                self.add_error(line_num, exc.detail)
+        return valid
+
+    def existing_by_name(self, names, for_update=False):
+        queryset = Sweet.objects.select_for_update() if for_update else Sweet.objects.all()
+        existing = {}
+        for sweet in queryset.filter(name__in=names).order_by('id'):
+            existing.setdefault(sweet.name, sweet)
+        return existing
+
+    def write_batch(self, batch):
+        if self.mode == 'restock':
+            self.restock_batch(self.validate(batch, BulkRestockRowSerializer))
+        else:
+            self.upsert_batch(self.validate(batch, SweetSerializer))
+
+    def upsert_batch(self, rows):
+        new = {}
+        changed = {}
+        reshard = {}
+        with transaction.atomic():
+            # Read inside the write transaction, and write back only the
+            # columns each row supplied: a price-only file must not put back
+            # the stock it read while purchases commit in between.
+            existing = self.existing_by_name({row['name'] for _, row in rows}, for_update=True)
+            now = timezone.now()
+            for _, row in rows:
+                sweet = existing.get(row['name']) or new.get(row['name'])
+                if sweet is None:
+                    new[row['name']] = Sweet(**row)
+                    continue
+                if sweet.shard_count and 'quantity' in row:
+                    # Sharded stock lives in the shards; Sweet.quantity stays 0.
+                    row = dict(row)
+                    reshard[sweet.pk] = row.pop('quantity')
+                for field, value in row.items():
+                    setattr(sweet, field, value)
+                if sweet.pk is not None:
+                    sweet.updated_at = now
+                    changed.setdefault(sweet.pk, (sweet, set()))[1].update(row)
+            by_fields = {}
+            for sweet, fields in changed.values():
+                key = tuple(field for field in UPSERT_FIELDS if field in fields or field == 'updated_at')
+                by_fields.setdefault(key, []).append(sweet)
+            Sweet.objects.bulk_create(new.values())
+            for fields, sweets in by_fields.items():
+                Sweet.objects.bulk_update(sweets, fields)
+            for pk, quantity in reshard.items():
+                sweet = changed[pk][0]
+                sweet.shard_stock(sweet.shard_count, quantity)
+        self.created += len(new)
+        self.updated += len(changed)
+
+    def restock_batch(self, rows):
+        existing = self.existing_by_name({row['name'] for _, row in rows})
+        quantities = {}
+        sweets = {}
+        for line_num, row in rows:
+            sweet = existing.get(row['name'])
+            if sweet is None:
+                self.add_error(line_num, {'name': [f"No sweet named '{row['name']}'"]})
+                continue
+            quantities[sweet.pk] = quantities.get(sweet.pk, 0) + row['quantity']
+            sweets[sweet.pk] = sweet
+        with transaction.atomic():
+            Sweet.objects.increment_stock_many(quantities)
+            record_stock_changes([(sweets[pk], quantity) for pk, quantity in quantities.items()],
+                                 InventoryEvent.RESTOCK, self.user_id)
+        self.restocked += len(quantities)
+
+    def summary(self):
+        return {
+            'mode': self.mode,
+            'processed': self.processed,
+            'created': self.created,
+            'updated': self.updated,
+            'restocked': self.restocked,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
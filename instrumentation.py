@@ -0,0 +1,175 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('api.performance')
+
+# Upper bounds, in milliseconds, of the latency histogram buckets.
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+_current = ContextVar('sweetshop_request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('queries', 'db', 'spans')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.spans = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook: times every query on the connection.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+
+class timed:
+    """Add the time spent in the block to the current request's named span.
+
+    A no-op outside an instrumented request, so call sites can stay in place
+    when instrumentation is switched off.
+    """
+    __slots__ = ('name', 'timings', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            spans = self.timings.spans
+            spans[self.name] = spans.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the pct-th sample; the last,
+        # unbounded bucket reports the observed maximum instead.
+        target = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': {
+                ('+Inf' if bound == float('inf') else str(bound)): count
+                for bound, count in zip(BUCKETS_MS, self.counts)
+            },
+        }
+
+
+class LatencyRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name, value_ms):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.observe(value_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+latency = LatencyRegistry()
+
+
+class PerformanceMiddleware:
+    """Per-request query count, DB, serializer and view time.
+
+    Enabled with SWEETSHOP_INSTRUMENTATION = True; list it first in
+    MIDDLEWARE so the view time covers the rest of the stack.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SWEETSHOP_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        view_ms = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match and match.url_name else 'unresolved'
+        latency.observe(url_name, view_ms)
+
+        db_ms = timings.db * 1000
+        serialize_ms = timings.spans.get('serialize', 0.0) * 1000
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.2f};desc="{timings.queries} queries"',
+            f'serialize;dur={serialize_ms:.2f}',
+            f'view;dur={view_ms:.2f}',
+        ])
+        logger.info(
+            '%s %s %s url_name=%s queries=%d db_ms=%.2f serialize_ms=%.2f view_ms=%.2f',
+            request.method, request.path, response.status_code, url_name,
+            timings.queries, db_ms, serialize_ms, view_ms,
+            extra={'performance': {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'url_name': url_name,
+                'queries': timings.queries,
+                'db_ms': round(db_ms, 3),
+                'serialize_ms': round(serialize_ms, 3),
+                'view_ms': round(view_ms, 3),
+            }},
+        )
+        return response
@@ -0,0 +1,179 @@
+import random
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import CategorySalesRollup, InventoryEvent, SalesRollup, SweetSalesRollup
+
+ROLLUP_BATCH_SIZE = 250
+
+
+def buckets(at):
+    # Rollup buckets are UTC hours and days.
+    if timezone.is_aware(at):
+        at = at.astimezone(dt_timezone.utc)
+    hour = at.replace(minute=0, second=0, microsecond=0)
+    return {SalesRollup.HOUR: hour, SalesRollup.DAY: hour.replace(hour=0)}
+
+
+def record_stock_changes(changes, kind, user_id=None, at=None):
+    """Append ledger events for `changes` and fold them into the rollups.
+
+    `changes` is a list of (sweet, delta) pairs, with sweet's category and
+    price as of the change. Must run in the transaction that changed the stock.
+    """
+    if not changes:
+        return
+    at = at or timezone.now()
+    InventoryEvent.objects.bulk_create([
+        InventoryEvent(sweet_id=sweet.pk, delta=delta, kind=kind, user_id=user_id, created_at=at)
+        for sweet, delta in changes
+    ])
+
+    by_sweet = {}
+    by_category = {}
+    for sweet, delta in changes:
+        sold = -delta if kind == InventoryEvent.PURCHASE else 0
+        restocked = delta if kind == InventoryEvent.RESTOCK else 0
+        totals = (sold, restocked, sweet.price * sold)
+        # Sharded sweets add to a random one of their rollup rows, like
+        # their stock; both rows of a change use the same shard.
+        shard = random.randrange(sweet.shard_count) if sweet.shard_count else 0
+        for key, target in (((sweet.pk, shard), by_sweet), ((sweet.category, shard), by_category)):
+            target[key] = tuple(map(sum, zip(target.get(key, (0, 0, Decimal('0'))), totals)))
+
+    # No savepoint: the caller's transaction already makes this atomic, and
+    # purchases are the hottest write path.
+    with transaction.atomic(savepoint=False):
+        for model, key_field, totals in ((CategorySalesRollup, 'category', by_category),
+                                         (SweetSalesRollup, 'sweet_id', by_sweet)):
+            rows = [(period, bucket, *key, *values)
+                    for period, bucket in buckets(at).items() for key, values in totals.items()]
+            if connection.features.supports_update_conflicts_with_target:
+                upsert_rollup(model, key_field, rows)
+                continue
+            by_shard = {}
+            for (key, shard), values in totals.items():
+                by_shard.setdefault(shard, {})[key] = values
+            for period, bucket in buckets(at).items():
+                for shard, shard_totals in by_shard.items():
+                    # Bulk restocks can touch thousands of sweets; batches
+                    # keep each CASE under the limit on query parameters.
+                    items = list(shard_totals.items())
+                    for start in range(0, len(items), ROLLUP_BATCH_SIZE):
+                        add_to_rollup(model, key_field, period, bucket, shard,
+                                      dict(items[start:start + ROLLUP_BATCH_SIZE]))
+
+
+def upsert_rollup(model, key_field, rows):
+    # One INSERT ... ON CONFLICT DO UPDATE adds (period, bucket, key, shard,
+    # sold, restocked, revenue) rows to the rollup, creating the ones that do
+    # not exist yet. The increments happen in the database, so concurrent
+    # writers never lose each other's counts.
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = [model._meta.get_field(name)
+              for name in ('period', 'bucket', key_field, 'shard', 'sold', 'restocked', 'revenue')]
+    columns = [qn(field.column) for field in fields]
+    row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES {{values}} "
+        f"ON CONFLICT ({', '.join(columns[:4])}) DO UPDATE SET "
+        + ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in columns[4:])
+    )
+    batch_size = ROLLUP_BATCH_SIZE
+    if connection.features.max_query_params:
+        batch_size = min(batch_size, connection.features.max_query_params // len(fields))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(sql.format(values=', '.join([row_sql] * len(batch))), [
+                field.get_db_prep_save(value, connection) for row in batch for field, value in zip(fields, row)
+            ])
+
+
+def add_to_rollup(model, key_field, period, bucket, shard, totals):
+    # For databases without ON CONFLICT: make sure every row exists, then add
+    # to all of them with a single UPDATE.
+    model.objects.bulk_create(
+        [model(period=period, bucket=bucket, shard=shard, **{key_field: key}) for key in totals],
+        ignore_conflicts=True,
+    )
+
+    # Keys with equal totals share one WHEN, so a bulk restock of the same
+    # quantity everywhere compiles to a single branch.
+    groups = {}
+    for key, values in totals.items():
+        groups.setdefault(values, []).append(key)
+
+    def increment(field, index):
+        return F(field) + Case(
+            *[When(**{f'{key_field}__in': keys}, then=Value(values[index])) for values, keys in groups.items()],
+            default=Value(0),
+            output_field=model._meta.get_field(field),
+        )
+
+    model.objects.filter(period=period, bucket=bucket, shard=shard, **{f'{key_field}__in': list(totals)}).update(
+        sold=increment('sold', 0),
+        restocked=increment('restocked', 1),
+        revenue=increment('revenue', 2),
+    )
+
+
+STATS_WINDOWS = {
+    SalesRollup.HOUR: timedelta(hours=48),
+    SalesRollup.DAY: timedelta(days=30),
+}
+
+STATS_GROUPS = {
+    'sweet': (SweetSalesRollup, 'sweet_id'),
+    'category': (CategorySalesRollup, 'category'),
+}
+
+
+def parse_timestamp(value):
+    # Accepts a date or a datetime; naive values are taken as UTC, like the buckets.
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def sales_stats(period, group, since, until, key=None):
+    """Per-bucket and window totals for one rollup; never touches the event ledger."""
+    model, key_field = STATS_GROUPS[group]
+    queryset = model.objects.filter(period=period, bucket__gte=since, bucket__lt=until)
+    if key is not None:
+        queryset = queryset.filter(**{key_field: key})
+
+    def row(values):
+        return {
+            group: values[key_field],
+            'sold': values['total_sold'],
+            'restocked': values['total_restocked'],
+            'revenue': f"{values['total_revenue'] or 0:.2f}",
+        }
+
+    def summed(*fields):
+        # Sums the shards of each bucket too.
+        return queryset.values(*fields).annotate(
+            total_sold=Sum('sold'), total_restocked=Sum('restocked'), total_revenue=Sum('revenue'),
+        )
+
+    buckets = [
+        {'bucket': values['bucket'], **row(values)}
+        for values in summed('bucket', key_field).order_by('bucket', key_field)
+    ]
+    totals = [row(values) for values in summed(key_field).order_by('-total_sold', key_field)]
+    return {'buckets': buckets, 'totals': totals}
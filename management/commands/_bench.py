@@ -0,0 +1,138 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ...models import Sweet
+
+FLAVOURS = [
+    'Chocolate', 'Vanilla', 'Strawberry', 'Caramel', 'Mint', 'Lemon', 'Raspberry',
+    'Hazelnut', 'Coconut', 'Toffee', 'Cherry', 'Pistachio', 'Mango', 'Honey',
+]
+KINDS = {
+    'chocolate': ['Bar', 'Truffle', 'Praline', 'Buttons'],
+    'candy': ['Gummies', 'Lollipop', 'Drops', 'Chews'],
+    'pastry': ['Croissant', 'Danish', 'Eclair', 'Tart'],
+    'ice_cream': ['Scoop', 'Sundae', 'Cone', 'Sorbet'],
+    'cake': ['Sponge', 'Cheesecake', 'Roll', 'Gateau'],
+    'cookie': ['Cookie', 'Biscuit', 'Shortbread', 'Macaron'],
+    'other': ['Fudge', 'Marshmallow', 'Nougat', 'Brittle'],
+}
+WORDS = ['rich', 'creamy', 'crunchy', 'chewy', 'handmade', 'classic', 'zesty', 'dark', 'milk', 'sugar-free']
+
+
+def generate_sweets(count, start=0, batch_size=5000, seed=0):
+    """Bulk-insert `count` realistic sweets, numbered from `start`."""
+    rng = random.Random(seed + start)
+    categories = list(KINDS)
+    created = 0
+    while created < count:
+        batch = []
+        for offset in range(min(batch_size, count - created)):
+            number = start + created + offset
+            category = rng.choice(categories)
+            flavour = rng.choice(FLAVOURS)
+            kind = rng.choice(KINDS[category])
+            batch.append(Sweet(
+                name=f'{flavour} {kind} {number}',
+                description=' '.join(rng.sample(WORDS, 3) + [flavour.lower(), kind.lower()]),
+                category=category,
+                price=Decimal(rng.randint(50, 5000)) / 100,
+                quantity=rng.randint(0, 500),
+            ))
+        Sweet.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def generate_users(count, password, prefix='bench-user', start=0, is_staff=False, batch_size=5000):
+    """Bulk-insert `count` users named `prefix`-N, all with `password`.
+
+    The password is hashed once and the hash shared, so a million users cost
+    one PBKDF2 run instead of a million.
+    """
+    encoded = make_password(password)
+    created = 0
+    while created < count:
+        batch = [
+            User(username=f'{prefix}-{start + created + offset}', password=encoded, is_staff=is_staff)
+            for offset in range(min(batch_size, count - created))
+        ]
+        User.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+@contextmanager
+def benchmark_database(alias=DEFAULT_DB_ALIAS):
+    """Run a benchmark against a throwaway, fully migrated copy of `alias`.
+
+    SQLite test databases are in-memory by default, which worker threads
+    cannot share, so the copy is placed in a temporary file instead.
+    """
+    connection = connections[alias]
+    if connection.vendor == 'sqlite':
+        fd, path = tempfile.mkstemp(prefix='sweetshop-bench-', suffix='.sqlite3')
+        os.close(fd)
+        connection.settings_dict['TEST']['NAME'] = path
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def request_host():
+    # APIRequestFactory's default "testserver" is only allowed under the test
+    # runner; outside it every request would fail with DisallowedHost.
+    for host in settings.ALLOWED_HOSTS:
+        if host == '*':
+            return 'testserver'
+        if host.lstrip('.'):
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def run_concurrently(worker, threads):
+    """Call `worker(index)` on `threads` threads; return wall-clock seconds.
+
+    The first exception a worker raises is raised again here once every
+    thread has finished, so a broken run cannot pass for a fast one.
+    """
+    failures = []
+
+    def target(index):
+        try:
+            worker(index)
+        except BaseException as exc:
+            failures.append(exc)
+        finally:
+            connections.close_all()
+
+    pool = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    if failures:
+        raise failures[0]
+    return time.perf_counter() - start
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,247 @@
+import json
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.urls import resolve, reverse
+from rest_framework.test import APIRequestFactory
+
+from ...authentication import SweetShopRefreshToken
+from ...models import Sweet
+from ._bench import (
+    FLAVOURS, KINDS, benchmark_database, generate_sweets, generate_users, percentile, request_host, run_concurrently,
+)
+
+PASSWORD = 'bench-password'
+DEFAULT_MIX = 'search=30,list=20,detail=30,purchase=10,restock=5,login=5'
+# Latency regressions smaller than this, or measured over fewer requests,
+# are noise whatever the percentage.
+MIN_LATENCY_DELTA_MS = 1.0
+MIN_LATENCY_SAMPLES = 20
+
+
+def search(factory, rng, context):
+    params = rng.choice([
+        {'q': rng.choice(FLAVOURS).lower()},
+        {'category': rng.choice(list(KINDS)), 'max_price': rng.choice(['5', '10', '25'])},
+        {'q': rng.choice(FLAVOURS).lower(), 'category': rng.choice(list(KINDS))},
+    ])
+    return factory.get(reverse('sweet-search'), params)
+
+
+def list_sweets(factory, rng, context):
+    return factory.get(reverse('sweet-list-create'), HTTP_AUTHORIZATION=context['user_token'])
+
+
+def detail(factory, rng, context):
+    return factory.get(reverse('sweet-detail', args=[rng.choice(context['ids'])]),
+                       HTTP_AUTHORIZATION=context['user_token'])
+
+
+def purchase(factory, rng, context):
+    return factory.post(reverse('sweet-purchase', args=[rng.choice(context['ids'])]), {'quantity': 1},
+                        format='json', HTTP_AUTHORIZATION=context['user_token'])
+
+
+def restock(factory, rng, context):
+    return factory.post(reverse('sweet-restock', args=[rng.choice(context['ids'])]), {'quantity': 5},
+                        format='json', HTTP_AUTHORIZATION=context['admin_token'])
+
+
+def login(factory, rng, context):
+    return factory.post(reverse('login'), {'username': rng.choice(context['usernames']), 'password': PASSWORD},
+                        format='json')
+
+
+OPERATIONS = {
+    'search': search,
+    'list': list_sweets,
+    'detail': detail,
+    'purchase': purchase,
+    'restock': restock,
+    'login': login,
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise CommandError(f"Unknown operation {name.strip()!r}; use {', '.join(OPERATIONS)}.")
+        try:
+            mix[name.strip()] = float(weight)
+        except ValueError:
+            raise CommandError(f'Invalid weight in {part!r}.')
+    if not any(weight > 0 for weight in mix.values()):
+        raise CommandError('--mix needs at least one positive weight.')
+    return mix
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Regressions of `results` against a saved run, as printable lines.
+
+    Per operation: no requests completed, p95 latency up by more than
+    `tolerance` (and at least MIN_LATENCY_DELTA_MS, over at least
+    MIN_LATENCY_SAMPLES requests), any extra query per request, or new errors.
+    Overall: throughput down by more than `tolerance`.
+    """
+    regressions = []
+    for name, base in baseline['operations'].items():
+        current = results['operations'].get(name)
+        if not current or not current['requests']:
+            regressions.append(f"{name}: no requests completed (baseline {base['requests']})")
+            continue
+        if (min(current['requests'], base['requests']) >= MIN_LATENCY_SAMPLES
+                and current['p95_ms'] > base['p95_ms'] * (1 + tolerance)
+                and current['p95_ms'] - base['p95_ms'] >= MIN_LATENCY_DELTA_MS):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current['queries'] > base['queries'] + 0.5:
+            regressions.append(f"{name}: queries/request {base['queries']:.1f} -> {current['queries']:.1f}")
+        if current['error_rate'] > base['error_rate'] + 0.01:
+            regressions.append(f"{name}: error rate {base['error_rate']:.1%} -> {current['error_rate']:.1%}")
+    if results['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.0f} -> {results['throughput']:.0f} req/s")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Replay a mixed API workload (search, list, detail, purchase, restock, login) against a '
+            'synthetic catalog and compare it with a saved baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sweets', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10.0)
+        parser.add_argument('--mix', default=DEFAULT_MIX)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', metavar='PATH')
+        parser.add_argument('--baseline', metavar='PATH')
+        parser.add_argument('--tolerance', type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        config = {key: options[key] for key in ('sweets', 'users', 'threads', 'seconds', 'mix')}
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            # Numbers from another catalog size or mix are not comparable.
+            if baseline.get('config') != config:
+                raise CommandError(f"Baseline was recorded with different options: {baseline.get('config')}")
+
+        with benchmark_database():
+            generate_sweets(options['sweets'], seed=options['seed'])
+            # Stock never runs out, so purchases measure the success path.
+            Sweet.objects.update(quantity=1_000_000)
+            generate_users(max(options['users'], 1), PASSWORD)
+            generate_users(1, PASSWORD, prefix='bench-admin', is_staff=True)
+            results = self.run(mix, options)
+
+        results['config'] = config
+        self.report(results)
+        broken = [name for name, result in results['operations'].items() if result['error_rate'] == 1]
+        if not results['requests'] or broken:
+            raise CommandError(f"Every {', '.join(broken) or 'operation'} request failed; nothing was measured.")
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Saved baseline to {options['save_baseline']}")
+        if baseline is not None:
+            self.check_baseline(results, baseline, options['tolerance'])
+
+    def run(self, mix, options):
+        users = list(User.objects.filter(username__startswith='bench-user-'))
+        admin = User.objects.get(username='bench-admin-0')
+        context = {
+            'ids': list(Sweet.objects.values_list('pk', flat=True)),
+            'usernames': [user.username for user in users],
+            'user_token': f'Bearer {SweetShopRefreshToken.for_user(users[0]).access_token}',
+            'admin_token': f'Bearer {SweetShopRefreshToken.for_user(admin).access_token}',
+        }
+        names, weights = zip(*mix.items())
+        samples = {name: {'latency': [], 'queries': [], 'errors': 0} for name in names}
+        first_errors = {}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+
+        def worker(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            factory = APIRequestFactory(SERVER_NAME=request_host())
+            local = {name: {'latency': [], 'queries': [], 'errors': 0} for name in names}
+            executed = []
+
+            def count_queries(execute, sql, params, many, query_context):
+                executed.append(1)
+                return execute(sql, params, many, query_context)
+
+            with connection.execute_wrapper(count_queries):
+                while time.perf_counter() < deadline:
+                    name = rng.choices(names, weights)[0]
+                    request = OPERATIONS[name](factory, rng, context)
+                    match = resolve(request.path)
+                    executed.clear()
+                    started = time.perf_counter()
+                    try:
+                        response = match.func(request, *match.args, **match.kwargs)
+                        if hasattr(response, 'render'):
+                            response.render()
+                        failed = response.status_code >= 400
+                    except Exception as exc:
+                        # What Django would answer with a 500; the first one
+                        # per operation is reported.
+                        failed = True
+                        with lock:
+                            first_errors.setdefault(name, f'{type(exc).__name__}: {exc}')
+                    elapsed = (time.perf_counter() - started) * 1000
+                    local[name]['latency'].append(elapsed)
+                    local[name]['queries'].append(len(executed))
+                    if failed:
+                        local[name]['errors'] += 1
+                    # Request boundary: drops connections unless they are persistent.
+                    close_old_connections()
+            with lock:
+                for name, values in local.items():
+                    samples[name]['latency'].extend(values['latency'])
+                    samples[name]['queries'].extend(values['queries'])
+                    samples[name]['errors'] += values['errors']
+
+        elapsed = run_concurrently(worker, options['threads'])
+        for name, error in first_errors.items():
+            self.stderr.write(f'{name} raised {error}')
+        operations = {}
+        for name, values in samples.items():
+            count = len(values['latency'])
+            if not count:
+                continue
+            operations[name] = {
+                'requests': count,
+                'throughput': count / elapsed,
+                'p50_ms': percentile(values['latency'], 50),
+                'p95_ms': percentile(values['latency'], 95),
+                'p99_ms': percentile(values['latency'], 99),
+                'queries': sum(values['queries']) / count,
+                'error_rate': values['errors'] / count,
+            }
+        total = sum(operation['requests'] for operation in operations.values())
+        return {'throughput': total / elapsed, 'requests': total, 'operations': operations}
+
+    def report(self, results):
+        self.stdout.write(f"{results['requests']} requests, {results['throughput']:.1f} req/s overall")
+        for name, result in results['operations'].items():
+            self.stdout.write(
+                '{name:>9}: {requests:6d} req {throughput:8.1f}/s  p50={p50_ms:7.1f}ms p95={p95_ms:7.1f}ms '
+                'p99={p99_ms:7.1f}ms  queries/req={queries:5.1f}  errors={error_rate:.1%}'.format(name=name, **result)
+            )
+
+    def check_baseline(self, results, baseline, tolerance):
+        regressions = compare_to_baseline(results, baseline, tolerance)
+        for line in regressions:
+            self.stderr.write(f'REGRESSION {line}')
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) against the baseline')
+        self.stdout.write(f'No regressions against the baseline (tolerance {tolerance:.0%})')
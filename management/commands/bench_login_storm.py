@@ -0,0 +1,89 @@
+import random
+import threading
+import time
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from ... import hashing
+from ...hashing import HashingBusy, HashingPool, authenticate_user
+from ...models import Sweet
+from ...serializers import SweetValuesSerializer
+from ._bench import benchmark_database, generate_sweets, percentile, run_concurrently
+
+STRATEGIES = ('inline', 'pool')
+
+
+class Command(BaseCommand):
+    help = 'Measure catalog-read latency while a login storm runs, with hashing inline or in the bounded pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sweets', type=int, default=2000)
+        parser.add_argument('--login-threads', type=int, default=16)
+        parser.add_argument('--read-threads', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--hash-workers', type=int, default=2)
+        parser.add_argument('--hash-queue', type=int, default=4)
+        parser.add_argument('--strategy', choices=STRATEGIES, action='append')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            generate_sweets(options['sweets'])
+            User.objects.create_user(username='storm', password='storm-password')
+            results = [self.run(name, options) for name in options['strategy'] or STRATEGIES]
+
+        for result in results:
+            self.stdout.write(
+                '{strategy:>6}: reads={reads} read p50={p50:.1f}ms p99={p99:.1f}ms  '
+                'logins={logins} rejected={rejected}'.format(**result)
+            )
+
+    def run(self, strategy, options):
+        pool = HashingPool(options['hash_workers'], options['hash_queue'])
+        hashing._pool = pool
+        names = list(Sweet.objects.values_list('name', flat=True))
+        serializer = SweetValuesSerializer()
+        deadline = time.perf_counter() + options['seconds']
+        login_threads = options['login_threads']
+        counts = {'logins': 0, 'rejected': 0}
+        samples = []
+        lock = threading.Lock()
+
+        def login():
+            if strategy == 'inline':
+                return authenticate(username='storm', password='storm-password')
+            return authenticate_user('storm', 'storm-password')
+
+        def worker(index):
+            rng = random.Random(index)
+            local = {'logins': 0, 'rejected': 0}
+            timings = []
+            while time.perf_counter() < deadline:
+                if index < login_threads:
+                    try:
+                        login()
+                        local['logins'] += 1
+                    except HashingBusy:
+                        local['rejected'] += 1
+                        time.sleep(0.01)
+                    continue
+                started = time.perf_counter()
+                rows = serializer.values(
+                    Sweet.objects.filter(name__gte=rng.choice(names)).order_by('name', 'id'))[:50]
+                serializer.many(rows)
+                timings.append((time.perf_counter() - started) * 1000)
+            with lock:
+                for key, value in local.items():
+                    counts[key] += value
+                samples.extend(timings)
+
+        run_concurrently(worker, login_threads + options['read_threads'])
+        hashing._pool = None
+        return {
+            'strategy': strategy,
+            'reads': len(samples),
+            'p50': percentile(samples, 50),
+            'p99': percentile(samples, 99),
+            **counts,
+        }
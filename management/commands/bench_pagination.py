@@ -0,0 +1,83 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ... import views
+from ...models import Sweet
+from ._bench import benchmark_database, generate_sweets
+
+
+class KeysetListView(views.SweetListCreateView):
+    # Without a cache scope every repeat runs the query instead of timing a
+    # catalog cache hit.
+    cache_scope = None
+
+
+class UnpaginatedListView(KeysetListView):
+    # The list view as it behaved before keyset pagination.
+    pagination_class = None
+
+
+class OffsetListView(KeysetListView):
+    pagination_class = LimitOffsetPagination
+
+
+class Command(BaseCommand):
+    help = 'Compare time-to-first-page of the unpaginated list, OFFSET paging and keyset paging.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--full-max', type=int, default=100000,
+            help='Skip the unpaginated baseline above this many rows.',
+        )
+
+    def handle(self, *args, **options):
+        self.factory = APIRequestFactory()
+        with benchmark_database():
+            self.user = User.objects.create_user(username='bench')
+            rows = 0
+            for size in sorted(options['sizes']):
+                rows += generate_sweets(size - rows, start=rows)
+                self.report(size, options)
+
+    def timed(self, view, query, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            request = self.factory.get('/api/sweets', query)
+            force_authenticate(request, user=self.user)
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            best = min(best, time.perf_counter() - start)
+            if response.status_code != 200:
+                raise CommandError(f'{view.__name__} returned {response.status_code}')
+        return best * 1000
+
+    def report(self, size, options):
+        page_size = options['page_size']
+        repeat = options['repeat']
+        middle = size // 2
+        results = {}
+
+        if size <= options['full_max']:
+            results['unpaginated'] = self.timed(UnpaginatedListView.as_view(), {}, 1)
+
+        offset = OffsetListView.as_view()
+        results['offset first'] = self.timed(offset, {'limit': page_size}, repeat)
+        results['offset middle'] = self.timed(offset, {'limit': page_size, 'offset': middle}, repeat)
+
+        keyset = KeysetListView.as_view()
+        position = list(Sweet.objects.order_by('name', 'id').values_list('name', 'id')[middle])
+        cursor = KeysetListView.pagination_class.make_token(position)
+        results['keyset first'] = self.timed(keyset, {'page_size': page_size}, repeat)
+        results['keyset middle'] = self.timed(
+            keyset, {'page_size': page_size, 'cursor': cursor}, repeat)
+
+        self.stdout.write(f'{size:>9} rows: ' + '  '.join(
+            f'{label}={value:9.2f} ms' for label, value in results.items()))
@@ -0,0 +1,89 @@
+import threading
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+
+from ...models import Sweet
+from ._bench import benchmark_database, run_concurrently
+
+
+def legacy_purchase(pk, quantity):
+    # The read-modify-write path purchase_sweet used before the conditional
+    # UPDATE; kept here only as the "before" side of the comparison.
+    sweet = Sweet.objects.get(pk=pk)
+    if sweet.quantity < quantity:
+        return False
+    sweet.quantity -= quantity
+    sweet.save()
+    return True
+
+
+def atomic_purchase(pk, quantity):
+    return Sweet.objects.decrement_stock(pk, quantity) == 1
+
+
+STRATEGIES = {
+    'legacy': legacy_purchase,
+    'atomic': atomic_purchase,
+}
+
+
+class Command(BaseCommand):
+    help = 'Fire concurrent purchases at one hot sweet and report throughput and overselling.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=2000)
+        parser.add_argument('--purchases', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--quantity', type=int, default=1)
+        parser.add_argument('--strategy', choices=sorted(STRATEGIES), action='append')
+
+    def handle(self, *args, **options):
+        strategies = options['strategy'] or ['legacy', 'atomic']
+        with benchmark_database():
+            results = [self.run(name, options) for name in strategies]
+
+        for result in results:
+            self.stdout.write(
+                '{strategy:>7}: {rate:9.1f} purchases/s  sold={sold} remaining={remaining} '
+                'rejected={rejected} lock_errors={errors} oversold={oversold}'.format(**result)
+            )
+        if any(r['oversold'] for r in results if r['strategy'] == 'atomic'):
+            raise CommandError('Atomic purchase path oversold stock.')
+
+    def run(self, strategy, options):
+        purchase = STRATEGIES[strategy]
+        quantity = options['quantity']
+        threads = options['threads']
+        sweet = Sweet.objects.create(
+            name=f'Hot sweet ({strategy})', category='candy',
+            price=Decimal('1.00'), quantity=options['stock'],
+        )
+        counts = {'sold': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            attempts = options['purchases'] // threads
+            if index < options['purchases'] % threads:
+                attempts += 1
+            local = {'sold': 0, 'rejected': 0, 'errors': 0}
+            for _ in range(attempts):
+                try:
+                    local['sold' if purchase(sweet.pk, quantity) else 'rejected'] += 1
+                except OperationalError:
+                    local['errors'] += 1
+            with lock:
+                for key, value in local.items():
+                    counts[key] += value
+
+        elapsed = run_concurrently(worker, threads)
+        sweet.refresh_from_db()
+        units_sold = counts['sold'] * quantity
+        return {
+            'strategy': strategy,
+            'rate': options['purchases'] / elapsed,
+            'remaining': sweet.quantity,
+            'oversold': units_sold - (options['stock'] - sweet.quantity),
+            **counts,
+        }
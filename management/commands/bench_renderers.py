@@ -0,0 +1,50 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from ...models import Sweet
+from ...renderers import MessagePackRenderer, ORJSONRenderer, msgpack, orjson
+from ...serializers import SweetValuesSerializer
+from ._bench import benchmark_database, generate_sweets
+
+
+class Command(BaseCommand):
+    help = 'Render a catalog listing with the stdlib JSON, orjson and MessagePack renderers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            generate_sweets(options['rows'])
+            serializer = SweetValuesSerializer()
+            data = {'next': None, 'previous': None,
+                    'results': serializer.many(serializer.values(Sweet.objects.order_by('name', 'id')))}
+
+        renderers = [('JSONRenderer', JSONRenderer())]
+        if orjson:
+            renderers.append(('ORJSONRenderer', ORJSONRenderer()))
+        if msgpack:
+            renderers.append(('MessagePackRenderer', MessagePackRenderer()))
+
+        reference = None
+        for label, renderer in renderers:
+            best = float('inf')
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                body = renderer.render(data, renderer.media_type)
+                best = min(best, time.perf_counter() - start)
+            if reference is None:
+                reference = body
+            elif isinstance(renderer, ORJSONRenderer) and body != reference:
+                raise CommandError('ORJSONRenderer output differs from JSONRenderer')
+            elif isinstance(renderer, MessagePackRenderer) and msgpack.unpackb(body) != json.loads(reference):
+                raise CommandError('MessagePackRenderer output does not decode to the JSON data')
+            self.stdout.write(
+                f"{label:>19}: {best * 1000:8.1f} ms for {options['rows']} rows  "
+                f"{len(body) / 1024:8.1f} KiB  gzip {len(gzip.compress(body, 6)) / 1024:7.1f} KiB"
+            )
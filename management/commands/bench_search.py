@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+
+from ... import views
+from ._bench import benchmark_database, generate_sweets
+
+QUERIES = [
+    # (label, legacy icontains params, full-text params)
+    ('common word', {'name': 'caramel'}, {'q': 'caramel'}),
+    ('two words', {'name': 'mint truffle'}, {'q': 'mint truffle'}),
+    ('prefix', {'name': 'pista'}, {'q': 'pista'}),
+    ('rare', {'name': '4242'}, {'q': '4242'}),
+    ('no match', {'name': 'liquorice'}, {'q': 'liquorice'}),
+]
+
+
+class SearchView(views.SweetSearchView):
+    # Uncached, so repeats time the query rather than a catalog cache hit.
+    cache_scope = None
+
+
+class Command(BaseCommand):
+    help = 'Compare the icontains search path with the FTS5 q= search on a synthetic catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000000)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = SearchView.as_view()
+
+        def timed(params):
+            best = float('inf')
+            for _ in range(options['repeat']):
+                request = factory.get('/api/sweets/search', {**params, 'page_size': options['page_size']})
+                start = time.perf_counter()
+                response = view(request)
+                response.render()
+                best = min(best, time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f'{params} returned {response.status_code}')
+            return best * 1000, len(response.data['results'])
+
+        with benchmark_database():
+            generate_sweets(options['size'])
+            self.stdout.write(f"{options['size']} sweets, first page of {options['page_size']}")
+            for label, legacy, fts in QUERIES:
+                legacy_ms, legacy_hits = timed(legacy)
+                fts_ms, fts_hits = timed(fts)
+                self.stdout.write(
+                    f'{label:>12}: icontains={legacy_ms:9.2f} ms ({legacy_hits:>2} hits)  '
+                    f'fts={fts_ms:9.2f} ms ({fts_hits:>2} hits)'
+                )
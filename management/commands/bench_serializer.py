@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Sweet
+from ...serializers import SweetSerializer, SweetValuesSerializer
+from ._bench import benchmark_database, generate_sweets
+
+GRID_FIELDS = ['id', 'name', 'price', 'quantity']
+
+
+def fast_path(serializer):
+    return serializer.many(serializer.values(Sweet.objects.all()))
+
+
+class Command(BaseCommand):
+    help = 'Serialize a catalog with SweetSerializer and with the values() fast path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            generate_sweets(options['rows'])
+            paths = [
+                ('SweetSerializer', lambda: SweetSerializer(Sweet.objects.all(), many=True).data),
+                ('values fast path', lambda: fast_path(SweetValuesSerializer())),
+                ('values, grid fields', lambda: fast_path(SweetValuesSerializer(GRID_FIELDS))),
+            ]
+            reference = None
+            for label, serialize in paths:
+                best = float('inf')
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    data = serialize()
+                    best = min(best, time.perf_counter() - start)
+                if reference is None:
+                    reference = [dict(item) for item in data]
+                elif len(data[0]) == len(reference[0]) and data != reference:
+                    raise CommandError(f'{label} output differs from SweetSerializer')
+                self.stdout.write(
+                    f"{label:>20}: {best * 1000:8.1f} ms for {options['rows']} rows "
+                    f"({best / options['rows'] * 1e6:.1f} us/row)"
+                )
@@ -0,0 +1,91 @@
+import threading
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ... import views
+from ...models import Sweet
+from ._bench import benchmark_database, generate_users, request_host, run_concurrently
+
+
+def purchase(factory, user, pk):
+    # The whole purchase_sweet view: the stock write, the ledger event and
+    # the rollups share one transaction, as they do for real buyers.
+    request = factory.post(reverse('sweet-purchase', args=[pk]), {'quantity': 1}, format='json')
+    force_authenticate(request, user=user)
+    return views.purchase_sweet(request, pk=pk).status_code
+
+
+class Command(BaseCommand):
+    help = ('Fire concurrent purchases (through the purchase view, ledger and rollups included) '
+            'at one hot sweet with its stock split over K shards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 1, 2, 4, 8, 16])
+        parser.add_argument('--stock', type=int, default=20000)
+        parser.add_argument('--purchases', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=16)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            generate_users(1, 'bench-password')
+            user = User.objects.get(username='bench-user-0')
+            results = [self.run(shards, user, options) for shards in options['shards']]
+
+        for result in results:
+            self.stdout.write(
+                'shards={shards:>3}: {rate:9.1f} purchases/s  sold={sold} remaining={remaining} '
+                'rejected={rejected} lock_errors={errors} oversold={oversold}'.format(**result)
+            )
+        if connection.vendor == 'sqlite':
+            self.stdout.write('SQLite lets one writer in at a time, so shards cannot raise throughput here; '
+                              'run this against PostgreSQL or MySQL to measure them.')
+        if any(result['oversold'] for result in results):
+            raise CommandError('Sharded purchase path oversold stock.')
+
+    def run(self, shards, user, options):
+        threads = options['threads']
+        sweet = Sweet.objects.create(
+            name=f'Hot sweet ({shards} shards)', category='candy',
+            price=Decimal('1.00'), quantity=options['stock'],
+        )
+        if shards:
+            sweet.shard_stock(shards)
+        counts = {'sold': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            attempts = options['purchases'] // threads
+            if index < options['purchases'] % threads:
+                attempts += 1
+            factory = APIRequestFactory(SERVER_NAME=request_host())
+            local = {'sold': 0, 'rejected': 0, 'errors': 0}
+            for _ in range(attempts):
+                try:
+                    status_code = purchase(factory, user, sweet.pk)
+                except OperationalError:
+                    local['errors'] += 1
+                    continue
+                finally:
+                    close_old_connections()
+                if status_code not in (200, 400):
+                    raise CommandError(f'Purchase answered {status_code}')
+                local['sold' if status_code == 200 else 'rejected'] += 1
+            with lock:
+                for key, value in local.items():
+                    counts[key] += value
+
+        elapsed = run_concurrently(worker, threads)
+        sweet.refresh_from_db()
+        remaining = sweet.total_quantity
+        return {
+            'shards': shards,
+            'rate': options['purchases'] / elapsed,
+            'remaining': remaining,
+            'oversold': counts['sold'] - (options['stock'] - remaining),
+            **counts,
+        }
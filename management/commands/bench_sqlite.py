@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, close_old_connections, connections, transaction
+
+from ...database import INIT_COMMAND, set_init_command, sqlite_databases
+from ...models import Sweet
+from ._bench import benchmark_database, generate_sweets, percentile, run_concurrently
+
+READ_ALIAS = 'bench_replica'
+
+
+def baseline_databases(name):
+    # Django's defaults, with the rollback journal pinned so a file left in
+    # WAL mode by an earlier run does not flatter the baseline.
+    default = {'OPTIONS': {}, 'CONN_MAX_AGE': 0}
+    set_init_command(default, 'PRAGMA journal_mode=DELETE')
+    return {DEFAULT_DB_ALIAS: default}
+
+
+PROFILES = {
+    'default': baseline_databases,
+    'tuned': lambda name: sqlite_databases(name, read_alias=READ_ALIAS),
+}
+
+
+class Command(BaseCommand):
+    help = 'Mixed catalog reads and purchases against one SQLite file, with and without the WAL profile.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sweets', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--write-ratio', type=float, default=0.2)
+        parser.add_argument('--profile', choices=sorted(PROFILES), action='append')
+
+    def handle(self, *args, **options):
+        with benchmark_database() as connection:
+            if connection.vendor != 'sqlite':
+                raise CommandError('bench_sqlite only makes sense on the sqlite3 backend.')
+            generate_sweets(options['sweets'])
+            Sweet.objects.update(quantity=1_000_000)
+            results = [self.run(name, options) for name in options['profile'] or ['default', 'tuned']]
+
+        for result in results:
+            self.stdout.write(
+                '{profile:>7}: {rate:9.1f} ops/s  reads={reads} writes={writes} lock_errors={errors}  '
+                'read p95={read_p95:.1f}ms  write p95={write_p95:.1f}ms'.format(**result)
+            )
+
+    def configure(self, profile):
+        # Point the default alias (already renamed to the benchmark file) and
+        # an extra read alias at the chosen settings for connections opened
+        # from here on.
+        connections.close_all()
+        default = connections.settings[DEFAULT_DB_ALIAS]
+        databases = PROFILES[profile](default['NAME'])
+        default.pop(INIT_COMMAND, None)
+        for key in ('OPTIONS', 'CONN_MAX_AGE', INIT_COMMAND):
+            if key in databases[DEFAULT_DB_ALIAS]:
+                default[key] = databases[DEFAULT_DB_ALIAS][key]
+        if READ_ALIAS in databases:
+            connections.settings[READ_ALIAS] = {**default, **{
+                key: databases[READ_ALIAS][key] for key in ('OPTIONS', INIT_COMMAND) if key in databases[READ_ALIAS]
+            }}
+            return READ_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def run(self, profile, options):
+        read_alias = self.configure(profile)
+        ids = list(Sweet.objects.values_list('pk', flat=True))
+        names = sorted(Sweet.objects.values_list('name', flat=True))
+        deadline = time.perf_counter() + options['seconds']
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        samples = {'read': [], 'write': []}
+        lock = threading.Lock()
+
+        def write(rng):
+            # A checkout-shaped transaction: read, then write.
+            pk = rng.choice(ids)
+            with transaction.atomic():
+                Sweet.objects.filter(pk=pk).values_list('quantity', flat=True).get()
+                Sweet.objects.decrement_stock(pk, 1)
+
+        def read(rng):
+            start = rng.choice(names)
+            list(Sweet.objects.using(read_alias).filter(name__gte=start).order_by('name', 'id').values()[:50])
+
+        def worker(index):
+            rng = random.Random(index)
+            local = {'reads': 0, 'writes': 0, 'errors': 0}
+            timings = {'read': [], 'write': []}
+            while time.perf_counter() < deadline:
+                kind = 'write' if rng.random() < options['write_ratio'] else 'read'
+                started = time.perf_counter()
+                try:
+                    (write if kind == 'write' else read)(rng)
+                    local[f'{kind}s'] += 1
+                    timings[kind].append((time.perf_counter() - started) * 1000)
+                except OperationalError:
+                    local['errors'] += 1
+                # Request boundary: drops connections unless they are persistent.
+                close_old_connections()
+            with lock:
+                for key, value in local.items():
+                    counts[key] += value
+                for key, value in timings.items():
+                    samples[key].extend(value)
+
+        elapsed = run_concurrently(worker, options['threads'])
+        connections.settings.pop(READ_ALIAS, None)
+        return {
+            'profile': profile,
+            'rate': (counts['reads'] + counts['writes']) / elapsed,
+            'read_p95': percentile(samples['read'], 95),
+            'write_p95': percentile(samples['write'], 95),
+            **counts,
+        }
+
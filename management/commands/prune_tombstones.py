@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...feed import prune_tombstones, tombstone_retention
+
+
+class Command(BaseCommand):
+    help = 'Delete change feed tombstones older than SWEETSHOP_TOMBSTONE_RETENTION_DAYS.'
+
+    def handle(self, *args, **options):
+        pruned = prune_tombstones()
+        self.stdout.write(f'Pruned {pruned} tombstone(s) older than {tombstone_retention().days} day(s)')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...caching import CACHE_WARNING, catalog_cache
+from ...models import ReservedStockError, Sweet
+
+
+class Command(BaseCommand):
+    help = "Split a hot sweet's stock over K counter shards (0 merges it back into Sweet.quantity)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('sweet_id', type=int)
+        parser.add_argument('shards', type=int)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shards'] <= 64:
+            raise CommandError('shards must be between 0 and 64.')
+        try:
+            sweet = Sweet.objects.get(pk=options['sweet_id'])
+        except Sweet.DoesNotExist:
+            raise CommandError(f"Sweet {options['sweet_id']} does not exist.")
+        try:
+            sweet.shard_stock(options['shards'])
+        except ReservedStockError as exc:
+            raise CommandError(str(exc))
+        catalog_cache.invalidate()
+        if catalog_cache.process_local:
+            self.stderr.write(CACHE_WARNING)
+        self.stdout.write(f'{sweet.name}: {sweet.total_quantity} in stock across {sweet.shard_count or 1} counter(s)')
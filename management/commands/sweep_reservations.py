@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...caching import CACHE_WARNING, catalog_cache
+from ...reservations import SWEEP_BATCH_SIZE, release_expired
+
+
+class Command(BaseCommand):
+    help = 'Release expired stock reservations; with --interval, keep doing so every N seconds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0)
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if catalog_cache.process_local:
+            self.stderr.write(CACHE_WARNING)
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            if released or not options['interval']:
+                self.stdout.write(f'Released {released} expired reservation(s)')
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
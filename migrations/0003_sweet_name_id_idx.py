@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_sweet_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sweet',
+            index=models.Index(fields=['name', 'id'], name='sweet_name_id_idx'),
+        ),
+    ]
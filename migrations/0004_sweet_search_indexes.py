@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_sweet_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sweet',
+            index=models.Index(fields=['category', 'price'], name='sweet_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sweet',
+            index=models.Index(fields=['price'], name='sweet_price_idx'),
+        ),
+    ]
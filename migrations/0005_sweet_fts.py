@@ -0,0 +1,92 @@
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+# External-content FTS5 index over Sweet.name/description. The triggers keep
+# it in sync for every write path, including QuerySet.update() and
+# bulk_create(), which bypass model signals. Only SQLite builds that ship
+# FTS5 get the table; elsewhere the q= search falls back to icontains.
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_sweet_fts USING fts5(
+        name, description,
+        content='api_sweet', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER api_sweet_fts_ai AFTER INSERT ON api_sweet BEGIN
+        INSERT INTO api_sweet_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER api_sweet_fts_ad AFTER DELETE ON api_sweet BEGIN
+        INSERT INTO api_sweet_fts(api_sweet_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER api_sweet_fts_au AFTER UPDATE OF name, description ON api_sweet BEGIN
+        INSERT INTO api_sweet_fts(api_sweet_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO api_sweet_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    # Name hits weigh ten times more than description hits in `rank`.
+    "INSERT INTO api_sweet_fts(api_sweet_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    "INSERT INTO api_sweet_fts(api_sweet_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS api_sweet_fts_au',
+    'DROP TRIGGER IF EXISTS api_sweet_fts_ad',
+    'DROP TRIGGER IF EXISTS api_sweet_fts_ai',
+    'DROP TABLE IF EXISTS api_sweet_fts',
+]
+
+
+def fts5_available(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def create_fts(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or not fts5_available(connection):
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_sweet_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+        migrations.CreateModel(
+            name='SweetSearchIndex',
+            fields=[
+                ('sweet', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='api.sweet')),
+                ('document', api.models.FullTextField(db_column='api_sweet_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_sweet_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_sweet_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SweetTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sweet_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sweet',
+            index=models.Index(fields=['updated_at', 'id'], name='sweet_updated_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sweettombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:55
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+fts = import_module('.0005_sweet_fts', __package__)
+
+
+def restore_fts_triggers(apps, schema_editor):
+    # Adding or removing a CHECK-constrained column makes SQLite rebuild
+    # api_sweet, which silently drops the FTS sync triggers from 0005.
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or not fts.fts5_available(connection):
+        return
+    for sql in fts.CREATE_SQL:
+        if 'CREATE TRIGGER' in sql:
+            schema_editor.execute(sql.replace('CREATE TRIGGER', 'CREATE TRIGGER IF NOT EXISTS'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name='sweet',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('sweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='api.sweet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('sweet', 'index'), name='stock_shard_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+restore_fts_triggers = import_module('.0008_stock_shards', __package__).restore_fts_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_stock_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name='sweet',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockshard',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='stockshard',
+            index=models.Index(fields=['updated_at', 'id'], name='stock_shard_updated_at_id_idx'),
+        ),
+    ]
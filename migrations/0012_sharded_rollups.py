@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_stock_shard_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='categorysalesrollup',
+            name='category_rollup_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='sweetsalesrollup',
+            name='sweet_rollup_unique',
+        ),
+        migrations.AddField(
+            model_name='categorysalesrollup',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sweetsalesrollup',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='categorysalesrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'category', 'shard'), name='category_rollup_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='sweetsalesrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'sweet', 'shard'), name='sweet_rollup_unique'),
+        ),
+    ]
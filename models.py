@@ -1,5 +1,196 @@
-from django.db import models
+import random
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Greatest, Round
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+# The largest price Sweet.price (max_digits=10, decimal_places=2) can store.
+MAX_PRICE = Decimal('99999999.99')
+
+
+class SweetQuerySet(models.QuerySet):
+    def decrement_stock(self, pk, quantity):
+        # Single conditional UPDATE: the stock check and the write happen in
+        # the database, so concurrent buyers can never oversell a row, nor
+        # buy stock that is held by a reservation.
+        updated = self.filter(pk=pk, quantity__gte=F('reserved') + quantity).update(
+            quantity=F('quantity') - quantity,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            return updated
+        # Sharded sweets keep Sweet.quantity at zero, so they always land
+        # here; ordinary sweets only do when they are out of stock.
+        shards = self.filter(pk=pk, shard_count__gt=0).values_list('shard_count', flat=True).first()
+        return self.decrement_sharded_stock(pk, quantity, shards) if shards else 0
+
+    def decrement_stock_many(self, quantities, batch_size=200):
+        # One CASE-based UPDATE per batch of lines. Every line carries its own
+        # stock guard, so the returned row count tells the caller whether all
+        # lines could be applied; callers run this inside a transaction and
+        # roll back on a short count.
+        quantities, sharded = self.split_sharded(quantities)
+        updated = sum(self.decrement_sharded_stock(pk, quantity, shards)
+                      for pk, (quantity, shards) in sharded.items())
+        items = list(quantities.items())
+        now = timezone.now()
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            guard = Q()
+            for pk, quantity in batch:
+                guard |= Q(pk=pk, quantity__gte=F('reserved') + quantity)
+            updated += self.filter(guard).update(
+                quantity=Case(*[When(pk=pk, then=F('quantity') - quantity) for pk, quantity in batch]),
+                updated_at=now,
+            )
+        return updated
+
+    def increment_stock(self, pk, quantity):
+        updated = self.filter(pk=pk, shard_count=0).update(
+            quantity=F('quantity') + quantity,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            return updated
+        shards = self.filter(pk=pk).values_list('shard_count', flat=True).first()
+        return self.increment_sharded_stock(pk, quantity, shards) if shards else 0
+
+    def increment_stock_many(self, quantities):
+        quantities, sharded = self.split_sharded(quantities)
+        updated = sum(self.increment_sharded_stock(pk, quantity, shards)
+                      for pk, (quantity, shards) in sharded.items())
+        if not quantities:
+            return updated
+        return updated + self.filter(pk__in=list(quantities)).update(
+            quantity=Case(*[When(pk=pk, then=F('quantity') + quantity) for pk, quantity in quantities.items()]),
+            updated_at=timezone.now(),
+        )
+
+    def increment_stock_all(self, quantity):
+        # Restock every sweet in the queryset: one UPDATE covers all plain
+        # sweets, and each sharded sweet adds one more.
+        sharded = self.filter(shard_count__gt=0).values_list('pk', 'shard_count')
+        updated = sum(self.increment_sharded_stock(pk, quantity, shards) for pk, shards in sharded)
+        return updated + self.filter(shard_count=0).update(
+            quantity=F('quantity') + quantity,
+            updated_at=timezone.now(),
+        )
+
+    @staticmethod
+    def repriced(percent=None, amount=None):
+        # The new price for a percentage or an absolute change, rounded to cents.
+        if percent is not None:
+            # The factor is computed here: SQLite stores whole-number prices
+            # as integers and would divide them as integers.
+            price = F('price') * Value((100 + percent) / 100, output_field=models.DecimalField())
+        else:
+            price = F('price') + amount
+        return Round(price, 2, output_field=models.DecimalField())
+
+    def reprice_overflows(self, percent=None, amount=None):
+        # How many sweets the change would give a price Sweet.price cannot
+        # hold, computed in SQL exactly as the UPDATE would.
+        return self.alias(new_price=self.repriced(percent, amount)).filter(new_price__gt=MAX_PRICE).count()
+
+    def reprice(self, percent=None, amount=None):
+        # A percentage or an absolute change, applied in a single UPDATE.
+        return self.update(price=self.repriced(percent, amount), updated_at=timezone.now())
+
+    # Reservations hold stock by counting it in Sweet.reserved, so reads get
+    # the available stock from one row instead of summing the holds. Sharded
+    # sweets cannot be reserved: a per-sweet counter would put back the
+    # single hot row that sharding removes.
+
+    def reserve_stock(self, pk, quantity):
+        return self.filter(pk=pk, shard_count=0, quantity__gte=F('reserved') + quantity).update(
+            reserved=F('reserved') + quantity,
+            updated_at=timezone.now(),
+        )
+
+    def take_reserved(self, pk, quantity):
+        # Turns a hold into a sale: stock and the reserved count drop together.
+        return self.filter(pk=pk, quantity__gte=quantity, reserved__gte=quantity).update(
+            quantity=F('quantity') - quantity,
+            reserved=F('reserved') - quantity,
+            updated_at=timezone.now(),
+        )
+
+    def release_reserved(self, quantities):
+        # One UPDATE for any number of sweets; sweets releasing the same
+        # quantity share a WHEN.
+        groups = {}
+        for pk, quantity in quantities.items():
+            groups.setdefault(quantity, []).append(pk)
+        return self.filter(pk__in=list(quantities)).update(
+            reserved=F('reserved') - Case(
+                *[When(pk__in=pks, then=Value(quantity)) for quantity, pks in groups.items()],
+                default=Value(0),
+            ),
+            updated_at=timezone.now(),
+        )
+
+    def split_sharded(self, quantities):
+        shards = dict(self.filter(pk__in=list(quantities), shard_count__gt=0).values_list('pk', 'shard_count'))
+        plain = {pk: quantity for pk, quantity in quantities.items() if pk not in shards}
+        return plain, {pk: (quantities[pk], count) for pk, count in shards.items()}
+
+    # Hot sweets split their stock over `shard_count` StockShard rows so
+    # concurrent purchases lock different rows instead of queueing on one.
+    # These paths never write the Sweet row itself, which is the point; the
+    # shard rows carry their own updated_at, which the change feed reads.
+
+    def decrement_sharded_stock(self, pk, quantity, shards):
+        rows = StockShard.objects.filter(sweet_id=pk)
+        now = timezone.now()
+        if rows.filter(index=random.randrange(shards), quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity, updated_at=now):
+            return 1
+        available = dict(rows.filter(quantity__gt=0).values_list('index', 'quantity'))
+        if sum(available.values()) < quantity:
+            return 0
+        # The random shard was short: drain the fullest shards instead, each
+        # step guarded and the whole line all-or-nothing.
+        with transaction.atomic():
+            remaining = quantity
+            for index in sorted(available, key=available.get, reverse=True):
+                take = min(available[index], remaining)
+                if not rows.filter(index=index, quantity__gte=take).update(quantity=F('quantity') - take,
+                                                                          updated_at=now):
+                    transaction.set_rollback(True)
+                    return 0
+                remaining -= take
+                if not remaining:
+                    return 1
+        return 0
+
+    def increment_sharded_stock(self, pk, quantity, shards):
+        base, extra = divmod(quantity, shards)
+        StockShard.objects.filter(sweet_id=pk).update(
+            quantity=F('quantity') + Case(
+                When(index__in=random.sample(range(shards), extra), then=Value(base + 1)),
+                default=Value(base),
+            ),
+            updated_at=timezone.now(),
+        )
+        return 1
+
+    def with_stock(self):
+        return self.annotate(stock=stock_total()).annotate(available=Greatest(F('stock') - F('reserved'), 0))
+
+
+def stock_total():
+    # Total stock as a column expression: Sweet.quantity, or the sum of the
+    # shards for sharded sweets.
+    shard_total = (StockShard.objects.filter(sweet=OuterRef('pk')).order_by()
+                   .values('sweet').annotate(total=Sum('quantity')).values('total'))
+    return Case(
+        When(shard_count=0, then=F('quantity')),
+        default=Subquery(shard_total),
+        output_field=models.PositiveIntegerField(),
+    )
 
 
 class Sweet(models.Model):
@@ -18,12 +209,216 @@ class Sweet(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES, default='other')
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=0)
+    # Stock held by active reservations (see reservations.py).
+    reserved = models.PositiveIntegerField(default=0)
+    shard_count = models.PositiveSmallIntegerField(default=0)
     image = models.CharField(max_length=500, blank=True, default='')
+    # Content hash of the uploaded image whose variants are ready (see images.py).
+    image_hash = models.CharField(max_length=32, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = SweetQuerySet.as_manager()
+
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='sweet_name_id_idx'),
+            models.Index(fields=['category', 'price'], name='sweet_category_price_idx'),
+            models.Index(fields=['price'], name='sweet_price_idx'),
+            models.Index(fields=['updated_at', 'id'], name='sweet_updated_at_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    @property
+    def total_quantity(self):
+        if not self.shard_count:
+            return self.quantity
+        return self.stock_shards.aggregate(total=Sum('quantity'))['total'] or 0
+
+    @property
+    def available_quantity(self):
+        return max(self.total_quantity - self.reserved, 0)
+
+    def shard_stock(self, shards, quantity=None):
+        """Spread this sweet's stock over `shards` counters; 0 turns sharding off.
+
+        `quantity` replaces the current total when given. Raises
+        ReservedStockError when sharding a sweet that has holds on it.
+        """
+        with transaction.atomic():
+            sweet = Sweet.objects.select_for_update().get(pk=self.pk)
+            if shards and sweet.reserved:
+                raise ReservedStockError(sweet)
+            current = StockShard.objects.select_for_update().filter(sweet=sweet)
+            if quantity is None:
+                quantity = sweet.quantity + sum(shard.quantity for shard in current)
+            StockShard.objects.filter(sweet=sweet).delete()
+            if shards:
+                base, extra = divmod(quantity, shards)
+                StockShard.objects.bulk_create([
+                    StockShard(sweet=self, index=index, quantity=base + (index < extra))
+                    for index in range(shards)
+                ])
+            # Guarded again in the write itself, for databases where the
+            # read above takes no lock: a hold placed since rolls it all back.
+            guard = Q(reserved=0) if shards else Q()
+            if not Sweet.objects.filter(guard, pk=self.pk).update(
+                quantity=0 if shards else quantity,
+                shard_count=shards,
+                updated_at=timezone.now(),
+            ):
+                raise ReservedStockError(Sweet.objects.get(pk=self.pk))
+        self.refresh_from_db()
+
+
+class ReservedStockError(Exception):
+    def __init__(self, sweet):
+        super().__init__(f'{sweet.name} has {sweet.reserved} reserved; sharded sweets cannot hold reservations.')
+
+
+class Reservation(models.Model):
+    # A short-lived hold on stock, e.g. during payment. Expired holds stay
+    # counted in Sweet.reserved until the sweeper releases them in bulk. Like
+    # the ledger, the user key has no constraint, so deleting a user leaves
+    # their holds to expire normally.
+    sweet = models.ForeignKey(Sweet, on_delete=models.CASCADE, related_name='reservations')
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+
+class StockShard(models.Model):
+    sweet = models.ForeignKey(Sweet, on_delete=models.CASCADE, related_name='stock_shards')
+    index = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sweet', 'index'], name='stock_shard_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='stock_shard_updated_at_id_idx'),
+        ]
+
+
+class SweetTombstone(models.Model):
+    # Records deleted sweets so the change feed can report deletions.
+    sweet_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_at_id_idx'),
+        ]
+
+
+class InventoryEvent(models.Model):
+    # Append-only stock ledger. The foreign keys carry no database constraint
+    # and are never cascaded so history survives deleted sweets and users
+    # without rewriting millions of rows.
+    PURCHASE = 'purchase'
+    RESTOCK = 'restock'
+    KIND_CHOICES = [
+        (PURCHASE, 'Purchase'),
+        (RESTOCK, 'Restock'),
+    ]
+
+    sweet = models.ForeignKey(Sweet, on_delete=models.DO_NOTHING, db_constraint=False,
+                              db_index=False, related_name='+')
+    delta = models.IntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, null=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sweet', 'created_at'], name='event_sweet_created_idx'),
+        ]
+
+
+class SalesRollup(models.Model):
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    # Sales of a sharded sweet are spread over as many rows per bucket as it
+    # has stock shards, so the rollups do not bring back the hot row that
+    # sharding removed. Readers sum across shards.
+    shard = models.PositiveSmallIntegerField(default=0)
+    sold = models.PositiveBigIntegerField(default=0)
+    restocked = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class SweetSalesRollup(SalesRollup):
+    sweet = models.ForeignKey(Sweet, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'sweet', 'shard'], name='sweet_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['sweet', 'period', 'bucket'], name='sweet_rollup_sweet_idx'),
+        ]
+
+
+class CategorySalesRollup(SalesRollup):
+    category = models.CharField(max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'category', 'shard'],
+                                    name='category_rollup_unique'),
+        ]
+
+
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class FullTextField(models.TextField):
+    pass
+
+
+FullTextField.register_lookup(FullTextMatch)
+
+
+class SweetSearchIndex(models.Model):
+    # Read-only view of the FTS5 table created in migration 0005. `document`
+    # maps to the hidden column named after the table, which is what MATCH
+    # runs against, and `rank` is FTS5's built-in bm25 relevance (lower is
+    # better).
+    sweet = models.OneToOneField(
+        Sweet, primary_key=True, db_column='rowid',
+        on_delete=models.DO_NOTHING, related_name='search_entry',
+    )
+    document = FullTextField(db_column='api_sweet_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'api_sweet_fts'
@@ -0,0 +1,73 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; JSON is then rendered by the stdlib.
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; MessagePack is not offered without it.
+    msgpack = None
+
+_encoder = encoders.JSONEncoder()
+
+
+def encode_default(obj):
+    # Anything the fast encoders do not handle themselves (Decimal, datetime,
+    # lazy strings, ...) is converted exactly as DRF's JSON encoder would.
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer with the encoding done by orjson.
+
+    Produces the same bytes as JSONRenderer: datetimes go through DRF's
+    encoder rather than orjson's own format, and U+2028/U+2029 are escaped
+    the same way. Pretty-printed or ASCII-only output, and data orjson
+    cannot encode (such as integers beyond 64 bits), fall back to
+    JSONRenderer.
+    """
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=encode_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Both separators encode to E2 80 A8/A9; scanning for the shared
+        # prefix first skips two copies of the body when neither occurs.
+        if b'\xe2\x80' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    # Values that JSON has no type for (prices, timestamps) are sent as the
+    # same strings the JSON renderers produce.
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+# Renderers for every API view: orjson-backed JSON first so it stays the
+# default, MessagePack when installed, then the project's other defaults
+# (e.g. the browsable API).
+API_RENDERERS = [
+    ORJSONRenderer,
+    *([MessagePackRenderer] if msgpack else []),
+    *(renderer for renderer in api_settings.DEFAULT_RENDERER_CLASSES if not issubclass(renderer, JSONRenderer)),
+]
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import catalog_cache
+from .models import Reservation, Sweet
+
+HOLD_SECONDS = 10 * 60
+SWEEP_BATCH_SIZE = 500
+
+
+def hold_seconds():
+    return getattr(settings, 'SWEETSHOP_RESERVATION_SECONDS', HOLD_SECONDS)
+
+
+def reserve(sweet_id, user_id, quantity):
+    """Hold `quantity` of a sweet for a user until the hold expires.
+
+    Returns the Reservation, or None when the sweet has too little unreserved
+    stock or is sharded.
+    """
+    with transaction.atomic():
+        if not Sweet.objects.reserve_stock(sweet_id, quantity):
+            return None
+        now = timezone.now()
+        reservation = Reservation.objects.create(
+            sweet_id=sweet_id,
+            user_id=user_id,
+            quantity=quantity,
+            created_at=now,
+            expires_at=now + timedelta(seconds=hold_seconds()),
+        )
+        catalog_cache.invalidate()
+    return reservation
+
+
+def claim(reservation_id, user_id):
+    """Remove one of the user's unexpired holds and return it, or None.
+
+    Deleting the row is the claim: when a purchase, a cancel and the sweeper
+    race for the same hold, only the one whose DELETE removed it goes on to
+    touch the stock. Call inside the transaction that settles the hold.
+    """
+    reservation = Reservation.objects.filter(
+        pk=reservation_id, user_id=user_id, expires_at__gt=timezone.now(),
+    ).first()
+    if reservation is None or not Reservation.objects.filter(pk=reservation.pk).delete()[0]:
+        return None
+    return reservation
+
+
+def cancel(reservation_id, user_id):
+    with transaction.atomic():
+        reservation = claim(reservation_id, user_id)
+        if reservation is not None:
+            Sweet.objects.release_reserved({reservation.sweet_id: reservation.quantity})
+            catalog_cache.invalidate()
+    return reservation
+
+
+def delete_holds(rows):
+    """Delete the (pk, sweet_id, quantity) holds in `rows`; return the ones this call removed.
+
+    As in claim(), only the DELETE that removes a row may give its stock
+    back. Another sweeper can delete some of the rows after they were read
+    (SQLite has no row locks to skip), so when the DELETE comes up short it
+    is undone and the rows are deleted one at a time.
+    """
+    pks = [pk for pk, _, _ in rows]
+    with transaction.atomic():
+        if Reservation.objects.filter(pk__in=pks).delete()[1].get(Reservation._meta.label, 0) == len(pks):
+            return rows
+        transaction.set_rollback(True)
+    return [row for row in rows if Reservation.objects.filter(pk=row[0]).delete()[0]]
+
+
+def release_expired(now=None, batch_size=SWEEP_BATCH_SIZE):
+    """Delete expired holds and give their stock back; returns how many were released.
+
+    Each batch is one DELETE plus one UPDATE across all the sweets it touches.
+    Rows locked by a purchase in progress are skipped, not waited for, and
+    rows another sweeper deleted first are not released twice.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = list(
+                Reservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('pk', 'sweet_id', 'quantity')[:batch_size]
+            )
+            if not expired:
+                break
+            deleted = delete_holds(expired)
+            quantities = {}
+            for _, sweet_id, quantity in deleted:
+                quantities[sweet_id] = quantities.get(sweet_id, 0) + quantity
+            if quantities:
+                Sweet.objects.release_reserved(quantities)
+                catalog_cache.invalidate()
+        released += len(deleted)
+        if len(expired) < batch_size:
+            break
+    return released
@@ -0,0 +1,81 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from rest_framework.exceptions import ValidationError
+
+from .models import SweetSearchIndex
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_tables = {}
+
+
+def fts_enabled(alias):
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        return False
+    key = (alias, str(connection.settings_dict['NAME']))
+    if key not in _fts_tables:
+        _fts_tables[key] = SweetSearchIndex._meta.db_table in connection.introspection.table_names()
+    return _fts_tables[key]
+
+
+def match_expression(text):
+    # Every word must match, and the last one may be a prefix of a longer
+    # word, which is what a search box expects while the user is typing.
+    tokens = TOKEN_RE.findall(text)
+    if not tokens:
+        return ''
+    terms = [f'"{token}"' for token in tokens[:-1]] + [f'"{tokens[-1]}"*']
+    return ' '.join(terms)
+
+
+def full_text_search(queryset, text):
+    """Filter `queryset` to sweets matching `text`, annotated with `search_rank` (lower is better)."""
+    match = match_expression(text)
+    if not match:
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if not fts_enabled(queryset.db):
+        return queryset.filter(
+            Q(name__icontains=text) | Q(description__icontains=text)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    # Joining the FTS table lets SQLite drive the query from the MATCH and
+    # compute each row's rank once, instead of once per correlated subquery.
+    return queryset.filter(search_entry__document__match=match).annotate(
+        search_rank=F('search_entry__rank'))
+
+
+def parse_price(value, param):
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        price = None
+    if price is None or not price.is_finite():
+        raise ValidationError({param: ['A valid number is required.']})
+    return price
+
+
+def filter_sweets(queryset, params):
+    """Apply the catalog search parameters shared by search, export and the bulk endpoints."""
+    q = params.get('q')
+    name = params.get('name')
+    category = params.get('category')
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+
+    if q:
+        queryset = full_text_search(queryset, q)
+    if name:
+        queryset = queryset.filter(name__icontains=name)
+    if category:
+        queryset = queryset.filter(category=category)
+    if min_price:
+        queryset = queryset.filter(price__gte=parse_price(min_price, 'min_price'))
+    if max_price:
+        queryset = queryset.filter(price__lte=parse_price(max_price, 'max_price'))
+
+    return queryset
@@ -1,6 +1,13 @@
-from rest_framework import serializers
+from functools import partial
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from django.contrib.auth.models import User
-from .models import Sweet
+from .hashing import hash_password
+from .images import variant_urls
+from .models import Reservation, ReservedStockError, Sweet
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -18,11 +25,14 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data.pop('password_confirm')
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data.get('email', ''),
-            password=validated_data['password']
+        # Same as User.objects.create_user, with the hash computed in the
+        # bounded hashing pool.
+        user = User(
+            username=User.normalize_username(validated_data['username']),
+            email=User.objects.normalize_email(validated_data.get('email', '')),
+            password=hash_password(validated_data['password'])
         )
+        user.save()
         return user
 
 
@@ -33,15 +43,151 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class SweetSerializer(serializers.ModelSerializer):
+    available = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = Sweet
-        fields = ['id', 'name', 'description', 'category', 'price', 'quantity', 'image', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'description', 'category', 'price', 'quantity', 'available', 'image', 'images',
+                  'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
 
+    def get_available(self, sweet):
+        return sweet.available_quantity
+
+    def get_images(self, sweet):
+        return variant_urls(sweet.image_hash)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.shard_count and 'quantity' in data:
+            data['quantity'] = instance.total_quantity
+        return data
+
+    def update(self, instance, validated_data):
+        if instance.shard_count and 'quantity' in validated_data:
+            try:
+                instance.shard_stock(instance.shard_count, validated_data.pop('quantity'))
+            except ReservedStockError as exc:
+                raise serializers.ValidationError({'quantity': [str(exc)]})
+        return super().update(instance, validated_data)
+
+
+class SweetValuesSerializer:
+    # Read-only fast path for rows from Sweet.objects.values(). Produces the
+    # same output as SweetSerializer but copies plain values straight into
+    # the dict. Only price and the timestamps need formatting, and for the
+    # default DRF settings that is done inline with the timezone resolved
+    # once per call instead of once per field per row.
+    field_names = SweetSerializer.Meta.fields
+    decimal_fields = ('price',)
+    datetime_fields = ('created_at', 'updated_at')
+    # quantity and available are read from the with_stock() annotations so
+    # sharded sweets report their full stock; images is built from the
+    # stored image hash.
+    columns = {'quantity': 'stock', 'images': 'image_hash'}
+    computed_fields = {'images': variant_urls}
+
+    def __init__(self, fields=None):
+        self.fields = list(fields or self.field_names)
+        self.sources = [(name, self.columns.get(name, name)) for name in self.fields]
+
+    def values(self, queryset, *extra):
+        columns = dict.fromkeys([*(source for _, source in self.sources), *extra])
+        if 'stock' in columns or 'available' in columns:
+            queryset = queryset.with_stock()
+        return queryset.values(*columns)
+
+    @classmethod
+    def parse_fields(cls, value):
+        if not value:
+            return list(cls.field_names)
+        requested = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in requested if name not in cls.field_names]
+        if unknown:
+            raise serializers.ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}"]})
+        return [name for name in cls.field_names if name in requested]
+
+    def get_formatters(self):
+        declared = None
+        formatters = []
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        for name in self.fields:
+            if name in self.decimal_fields:
+                if api_settings.COERCE_DECIMAL_TO_STRING:
+                    # Values come back from the database already quantized
+                    # to the field's decimal_places.
+                    formatters.append((name, '{:f}'.format))
+                    continue
+            elif name in self.datetime_fields:
+                if api_settings.DATETIME_FORMAT == ISO_8601:
+                    formatters.append((name, partial(format_iso_datetime, tz=tz)))
+                    continue
+            elif name in self.computed_fields:
+                formatters.append((name, self.computed_fields[name]))
+                continue
+            else:
+                continue
+            declared = declared or SweetSerializer().fields
+            formatters.append((name, declared[name].to_representation))
+        return formatters
+
+    def to_representation(self, row, formatters=None):
+        data = {name: row[source] for name, source in self.sources}
+        for name, formatter in formatters or self.get_formatters():
+            if data[name] is not None:
+                data[name] = formatter(data[name])
+        return data
+
+    def many(self, rows):
+        formatters = self.get_formatters()
+        return [self.to_representation(row, formatters) for row in rows]
+
+
+def format_iso_datetime(value, tz=None):
+    # Mirrors rest_framework.fields.DateTimeField.to_representation for the
+    # default ISO 8601 output format.
+    if tz is not None:
+        value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class ReservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Reservation
+        fields = ['id', 'sweet', 'quantity', 'created_at', 'expires_at']
+
 
 class PurchaseSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1, default=1)
 
 
+class CheckoutLineSerializer(PurchaseSerializer):
+    id = serializers.IntegerField(min_value=1)
+
+
 class RestockSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1)
+
+
+class MassRestockSerializer(RestockSerializer):
+    dry_run = serializers.BooleanField(default=False)
+
+
+class RepriceSerializer(serializers.Serializer):
+    percent = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=-100, max_value=1000,
+                                       required=False)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if ('percent' in data) == ('amount' in data):
+            raise serializers.ValidationError('Give exactly one of percent or amount')
+        return data
+
+
+class BulkRestockRowSerializer(RestockSerializer):
+    name = serializers.CharField(max_length=200)
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import revoke_user_tokens
+from .caching import catalog_cache
+from .database import run_init_command
+from .models import Sweet, SweetTombstone
+from .suggest import suggest_index
+
+
+# Model saves and deletes (the generic views, the admin, the shell) invalidate
+# the catalog cache here; QuerySet.update() and bulk writes send no signals,
+# so those call sites invalidate explicitly.
+@receiver(post_save, sender=Sweet)
+@receiver(post_delete, sender=Sweet)
+def invalidate_catalog_cache(sender, **kwargs):
+    catalog_cache.invalidate()
+
+
+# Deleted rows drop out of the change feed, so leave a tombstone behind for
+# clients syncing incrementally.
+@receiver(post_delete, sender=Sweet)
+def record_sweet_tombstone(sender, instance, **kwargs):
+    SweetTombstone.objects.create(sweet_id=instance.pk)
+
+
+# The typeahead index only changes once the write has committed.
+@receiver(post_save, sender=Sweet)
+def update_suggest_index(sender, instance, **kwargs):
+    pk, name, category = instance.pk, instance.name, instance.category
+    transaction.on_commit(lambda: suggest_index.update(pk, name, category))
+
+
+@receiver(post_delete, sender=Sweet)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: suggest_index.remove(pk))
+
+
+# Tokens carry is_staff and the username as claims, so any change to a user
+# (demotion, deactivation, password change) has to revoke what was issued.
+@receiver(post_save, sender=get_user_model())
+def revoke_tokens_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    revoke_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def revoke_tokens_on_user_delete(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk)
+
+
+# The SQLite profile's PRAGMAs on Django versions without init_command.
+@receiver(connection_created)
+def apply_init_command(sender, connection, **kwargs):
+    run_init_command(connection)
@@ -0,0 +1,148 @@
+import threading
+import unicodedata
+import uuid
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from .caching import catalog_cache
+from .models import Sweet
+
+VERSION_KEY = 'sweetshop:suggest:version'
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+
+def normalize(text):
+    # Case- and accent-insensitive, with runs of whitespace collapsed.
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def word_keys(name):
+    # "dark chocolate bar" -> "chocolate bar", "bar": lets a prefix match
+    # the start of any later word too.
+    words = name.split(' ')
+    return [' '.join(words[index:]) for index in range(1, len(words))]
+
+
+class PrefixIndex:
+    """In-process typeahead index over sweet names.
+
+    Two sorted lists of (normalized key, id) pairs are searched with bisect:
+    whole names first, then names matched at a later word. Each category
+    also has its own pair of lists, so a category filter never scans past
+    other categories' matches. The index is built on first use and kept
+    current by the Sweet save/delete signals.
+    Writes also replace a version token in the catalog cache backend; other
+    processes notice the new token and rebuild on their next query, as does
+    this one after bulk writes that send no signals.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._sweets = None
+            self._names = {}
+            self._words = {}
+            self._version = None
+
+    def shared_version(self):
+        version = catalog_cache.backend.get(VERSION_KEY)
+        if version is None:
+            catalog_cache.backend.add(VERSION_KEY, uuid.uuid4().hex, None)
+            version = catalog_cache.backend.get(VERSION_KEY)
+        return version
+
+    def invalidate(self):
+        """Replace the shared token; returns (previous token, new token)."""
+        previous = self.shared_version()
+        token = uuid.uuid4().hex
+        catalog_cache.backend.set(VERSION_KEY, token, None)
+        return previous, token
+
+    def ensure_built(self):
+        version = self.shared_version()
+        if self._sweets is not None and self._version == version:
+            return
+        sweets = {pk: (name, category) for pk, name, category in Sweet.objects.values_list('id', 'name', 'category')}
+        names = defaultdict(list)
+        words = defaultdict(list)
+        for pk, (name, category) in sweets.items():
+            key = normalize(name)
+            for bucket in (None, category):
+                names[bucket].append((key, pk))
+                words[bucket].extend((word, pk) for word in word_keys(key))
+        for entries in (*names.values(), *words.values()):
+            entries.sort()
+        with self._lock:
+            self._sweets, self._names, self._words, self._version = sweets, names, words, version
+
+    def _add(self, pk, name, category):
+        key = normalize(name)
+        self._sweets[pk] = (name, category)
+        for bucket in (None, category):
+            insort(self._names[bucket], (key, pk))
+            for word in word_keys(key):
+                insort(self._words[bucket], (word, pk))
+
+    def _discard(self, pk):
+        name, category = self._sweets.pop(pk)
+        key = normalize(name)
+        for bucket in (None, category):
+            pairs = [(self._names[bucket], key), *((self._words[bucket], word) for word in word_keys(key))]
+            for entries, entry_key in pairs:
+                index = bisect_left(entries, (entry_key, pk))
+                if index < len(entries) and entries[index] == (entry_key, pk):
+                    del entries[index]
+
+    def update(self, pk, name, category):
+        with self._lock:
+            if self._sweets is not None and self._sweets.get(pk) == (name, category):
+                return
+        self.apply(pk, lambda: self._add(pk, name, category))
+
+    def remove(self, pk):
+        self.apply(pk, lambda: None)
+
+    def apply(self, pk, add):
+        previous, token = self.invalidate()
+        with self._lock:
+            if self._sweets is None:
+                return
+            if previous != self._version:
+                # Another process changed names since we built; rebuild on
+                # the next query instead of patching a stale index.
+                self._version = None
+                return
+            if pk in self._sweets:
+                self._discard(pk)
+            add()
+            self._version = token
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT, category=None):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.ensure_built()
+        results = []
+        seen = set()
+        with self._lock:
+            for entries in (self._names.get(category or None, ()), self._words.get(category or None, ())):
+                index = bisect_left(entries, (prefix,))
+                while index < len(entries) and len(results) < limit:
+                    key, pk = entries[index]
+                    if not key.startswith(prefix):
+                        break
+                    index += 1
+                    if pk in seen:
+                        continue
+                    name, sweet_category = self._sweets[pk]
+                    seen.add(pk)
+                    results.append({'id': pk, 'name': name, 'category': sweet_category})
+        return results
+
+
+suggest_index = PrefixIndex()
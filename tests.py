@@ -1,10 +1,60 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+import django
+from django.core.cache.backends.dummy import DummyCache
+from django.core.exceptions import DisallowedHost
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.db.utils import ConnectionHandler
+from django.test import RequestFactory, SimpleTestCase, TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework_simplejwt.tokens import AccessToken
 from decimal import Decimal
-from .models import Sweet
+from pathlib import Path
+from .authentication import auth_cache
+from .caching import catalog_cache
+from .hashing import HashingBusy, HashingPool
+from .idempotency import IdempotencyStore, idempotency_store
+from .importers import SweetImporter
+from . import images as image_pipeline
+from .images import Image, image_storage
+from .renderers import ORJSONRenderer, msgpack, orjson
+from .suggest import suggest_index
+from .database import ReadReplicaMiddleware, ReadReplicaRouter, sqlite_databases
+from .feed import StockBroadcaster, broadcaster, encode_watermark
+from .instrumentation import latency
+from .ledger import record_stock_changes
+from .pagination import KeysetPagination
+from .management.commands import bench_api, bench_pagination, bench_search
+from .management.commands._bench import run_concurrently
+from .management.commands.bench_api import compare_to_baseline
+from .models import (
+    CategorySalesRollup, InventoryEvent, Reservation, ReservedStockError, StockShard, Sweet, SweetSalesRollup,
+    SweetTombstone,
+)
+from .reservations import claim, release_expired, reserve
+from .serializers import SweetSerializer, SweetValuesSerializer
 
 
 class UserAuthTests(APITestCase):
@@ -122,7 +172,7 @@ class SweetAPITests(APITestCase):
         self.authenticate_user()
         response = self.client.get(self.sweets_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_create_sweet_admin(self):
         self.authenticate_admin()
@@ -199,22 +249,26 @@ class SweetSearchTests(APITestCase):
         self.authenticate()
         response = self.client.get(f'{self.search_url}?name=chocolate')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], 'Chocolate Bar')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Chocolate Bar')
 
     def test_search_by_category(self):
         self.authenticate()
         response = self.client.get(f'{self.search_url}?category=candy')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], 'Gummy Bears')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Gummy Bears')
 
     def test_search_by_price_range(self):
         self.authenticate()
         response = self.client.get(f'{self.search_url}?min_price=2&max_price=10')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], 'Chocolate Bar')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Chocolate Bar')
+
+    def test_search_invalid_price(self):
+        response = self.client.get(f'{self.search_url}?min_price=cheap')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class PurchaseRestockTests(APITestCase):
@@ -272,3 +326,1512 @@ class PurchaseRestockTests(APITestCase):
         url = f'/api/sweets/{self.sweet.id}/restock'
         response = self.client.post(url, {'quantity': 50}, format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_purchase_sweet_not_found(self):
+        self.authenticate_user()
+        response = self.client.post('/api/sweets/9999/purchase', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_decrement_stock_never_oversells(self):
+        self.assertEqual(Sweet.objects.decrement_stock(self.sweet.pk, 10), 1)
+        self.assertEqual(Sweet.objects.decrement_stock(self.sweet.pk, 1), 0)
+        self.sweet.refresh_from_db()
+        self.assertEqual(self.sweet.quantity, 0)
+
+
+class FullTextSearchTests(APITestCase):
+    def setUp(self):
+        Sweet.objects.create(name='Chocolate Bar', description='Milk chocolate', category='chocolate',
+                             price=Decimal('2.50'), quantity=100)
+        Sweet.objects.create(name='Gummy Bears', description='Fruity chewy gummies', category='candy',
+                             price=Decimal('1.50'), quantity=50)
+        Sweet.objects.create(name='Mud Cake', description='Rich chocolate sponge', category='cake',
+                             price=Decimal('15.00'), quantity=10)
+        self.search_url = '/api/sweets/search'
+
+    def names(self, query):
+        response = self.client.get(self.search_url, query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [sweet['name'] for sweet in response.data['results']]
+
+    def test_search_matches_name_and_description_ranked(self):
+        self.assertEqual(self.names({'q': 'chocolate'}), ['Chocolate Bar', 'Mud Cake'])
+
+    def test_search_matches_prefix(self):
+        self.assertEqual(self.names({'q': 'gumm'}), ['Gummy Bears'])
+
+    def test_search_combines_with_filters(self):
+        self.assertEqual(self.names({'q': 'choc', 'category': 'cake'}), ['Mud Cake'])
+
+    def test_search_index_follows_writes(self):
+        sweet = Sweet.objects.get(name='Gummy Bears')
+        sweet.name = 'Sour Worms'
+        sweet.save()
+        self.assertEqual(self.names({'q': 'gummy'}), [])
+        self.assertEqual(self.names({'q': 'fruity'}), ['Sour Worms'])
+        self.assertEqual(self.names({'q': 'worms'}), ['Sour Worms'])
+        sweet.delete()
+        self.assertEqual(self.names({'q': 'worms'}), [])
+
+    def test_search_pages_by_rank(self):
+        first = self.client.get(self.search_url, {'q': 'chocolate', 'page_size': 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual([s['name'] for s in first.data['results'] + second.data['results']],
+                         ['Chocolate Bar', 'Mud Cake'])
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        for name in ['Toffee', 'Brownie', 'Fudge', 'Brownie', 'Eclair']:
+            Sweet.objects.create(name=name, category='other', price=Decimal('1.00'), quantity=1)
+        self.sweets_url = '/api/sweets'
+
+    def authenticate(self):
+        response = self.client.post('/api/auth/login', {
+            'username': 'testuser',
+            'password': 'testpass123'
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_pages_follow_name_then_id(self):
+        self.authenticate()
+        seen = []
+        url = f'{self.sweets_url}?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend((sweet['name'], sweet['id']) for sweet in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, sorted(Sweet.objects.values_list('name', 'id')))
+
+    def test_previous_link_returns_preceding_page(self):
+        self.authenticate()
+        first = self.client.get(f'{self.sweets_url}?page_size=2')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_page_size_is_capped(self):
+        self.authenticate()
+        response = self.client.get(f'{self.sweets_url}?page_size=100000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        self.authenticate()
+        response = self.client.get(f'{self.sweets_url}?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_values_of_the_wrong_type(self):
+        self.authenticate()
+        for position in ([None, 1], ['x', [1]], ['x', 'y'], [{}, None]):
+            cursor = KeysetPagination.make_token(position)
+            response = self.client.get(f'{self.sweets_url}?cursor={cursor}')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+        # A listing cursor replayed on a ranked search.
+        first = self.client.get(f'{self.sweets_url}?page_size=2')
+        cursor = first.data['next'].split('cursor=')[1].split('&')[0]
+        response = self.client.get(f'{self.sweets_url}/search?q=brownie&cursor={cursor}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CheckoutTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.chocolate = Sweet.objects.create(name='Chocolate Bar', category='chocolate',
+                                              price=Decimal('2.50'), quantity=10)
+        self.gummies = Sweet.objects.create(name='Gummy Bears', category='candy',
+                                            price=Decimal('1.50'), quantity=5)
+        self.checkout_url = '/api/sweets/checkout'
+
+    def authenticate(self):
+        response = self.client.post('/api/auth/login', {
+            'username': 'testuser',
+            'password': 'testpass123'
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_checkout_unauthenticated(self):
+        response = self.client.post(self.checkout_url, [{'id': self.chocolate.id}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_checkout_success(self):
+        self.authenticate()
+        response = self.client.post(self.checkout_url, [
+            {'id': self.chocolate.id, 'quantity': 2},
+            {'id': self.gummies.id, 'quantity': 3},
+            {'id': self.chocolate.id},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], '12.00')
+        self.assertEqual(len(response.data['sweets']), 2)
+        self.chocolate.refresh_from_db()
+        self.gummies.refresh_from_db()
+        self.assertEqual(self.chocolate.quantity, 7)
+        self.assertEqual(self.gummies.quantity, 2)
+
+    def test_checkout_not_enough_stock_applies_nothing(self):
+        self.authenticate()
+        response = self.client.post(self.checkout_url, [
+            {'id': self.chocolate.id, 'quantity': 2},
+            {'id': self.gummies.id, 'quantity': 6},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['available'], {self.gummies.id: 5})
+        self.chocolate.refresh_from_db()
+        self.assertEqual(self.chocolate.quantity, 10)
+
+    def test_checkout_unknown_sweet(self):
+        self.authenticate()
+        response = self.client.post(self.checkout_url, [{'id': 9999, 'quantity': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_decrement_stock_many_reports_short_lines(self):
+        updated = Sweet.objects.decrement_stock_many({self.chocolate.id: 1, self.gummies.id: 6})
+        self.assertEqual(updated, 1)
+
+
+class BulkImportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        Sweet.objects.create(name='Chocolate Bar', category='chocolate', price=Decimal('2.50'), quantity=10)
+        self.import_url = '/api/sweets/import'
+
+    def authenticate(self, username, password):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_import_regular_user_forbidden(self):
+        self.authenticate('testuser', 'testpass123')
+        response = self.client.generic('POST', self.import_url, 'name,price\nX,1.00\n', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_csv_upserts_by_name(self):
+        self.authenticate('admin', 'adminpass123')
+        body = (
+            'name,description,category,price,quantity\n'
+            'Chocolate Bar,"Dark, 70%",chocolate,3.00,40\n'
+            'Gummy Bears,,candy,1.50,25\n'
+            'Broken,,candy,not-a-price,1\n'
+        )
+        response = self.client.generic('POST', self.import_url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['error_count'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 4)
+        chocolate = Sweet.objects.get(name='Chocolate Bar')
+        self.assertEqual(chocolate.price, Decimal('3.00'))
+        self.assertEqual(chocolate.description, 'Dark, 70%')
+        self.assertEqual(Sweet.objects.count(), 2)
+
+    def test_upsert_only_writes_supplied_columns(self):
+        self.authenticate('admin', 'adminpass123')
+        read = SweetImporter.existing_by_name
+
+        def read_then_sell(importer, names, **kwargs):
+            existing = read(importer, names, **kwargs)
+            # A purchase commits between the importer's read and its write.
+            Sweet.objects.decrement_stock(existing['Chocolate Bar'].pk, 3)
+            return existing
+
+        with mock.patch.object(SweetImporter, 'existing_by_name', read_then_sell):
+            response = self.client.generic('POST', self.import_url, 'name,price\nChocolate Bar,4.00\n',
+                                           content_type='text/csv')
+        self.assertEqual(response.data['updated'], 1)
+        chocolate = Sweet.objects.get(name='Chocolate Bar')
+        self.assertEqual((chocolate.price, chocolate.quantity), (Decimal('4.00'), 7))
+
+    def test_import_ndjson_restock(self):
+        self.authenticate('admin', 'adminpass123')
+        body = (
+            '{"name": "Chocolate Bar", "quantity": 5}\n'
+            '{"name": "Chocolate Bar", "quantity": 7}\n'
+            '{"name": "Unknown", "quantity": 1}\n'
+            'not json\n'
+        )
+        response = self.client.generic('POST', f'{self.import_url}?mode=restock', body,
+                                       content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['restocked'], 1)
+        self.assertEqual(response.data['error_count'], 2)
+        self.assertEqual(Sweet.objects.get(name='Chocolate Bar').quantity, 22)
+
+    def test_import_unsupported_content_type(self):
+        self.authenticate('admin', 'adminpass123')
+        response = self.client.post(self.import_url, [{'name': 'X'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.sweet = Sweet.objects.create(name='Chocolate Bar', category='chocolate',
+                                          price=Decimal('2.50'), quantity=10)
+        self.detail_url = f'/api/sweets/{self.sweet.id}'
+
+    def authenticate(self, username, password):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_repeat_read_is_served_from_cache(self):
+        self.authenticate('testuser', 'testpass123')
+        self.client.get(self.detail_url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url)
+        self.assertFalse([q for q in queries.captured_queries if 'api_sweet' in q['sql']])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'], 10)
+
+    def test_if_none_match_returns_not_modified(self):
+        self.authenticate('testuser', 'testpass123')
+        etag = self.client.get(self.detail_url)['ETag']
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_purchase_invalidates_cached_reads(self):
+        self.authenticate('testuser', 'testpass123')
+        etag = self.client.get(self.detail_url)['ETag']
+        self.client.post(f'{self.detail_url}/purchase', {'quantity': 3}, format='json')
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'], 7)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_cache_stats_admin_only(self):
+        self.authenticate('testuser', 'testpass123')
+        response = self.client.get('/api/sweets/cache/stats')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.authenticate('admin', 'adminpass123')
+        response = self.client.get('/api/sweets/cache/stats')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hits', response.data)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.sweet = Sweet.objects.create(name='Chocolate Bar', description='Milk chocolate',
+                                          category='chocolate', price=Decimal('2.50'), quantity=10)
+
+    def authenticate(self):
+        response = self.client.post('/api/auth/login', {
+            'username': 'testuser',
+            'password': 'testpass123'
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_fast_path_matches_model_serializer(self):
+        serializer = SweetValuesSerializer()
+        row = serializer.values(Sweet.objects.all()).get(pk=self.sweet.pk)
+        self.assertEqual(serializer.to_representation(row), SweetSerializer(self.sweet).data)
+
+    def test_list_fields_projection(self):
+        self.authenticate()
+        response = self.client.get('/api/sweets?fields=id,name,price,quantity')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': self.sweet.id, 'name': 'Chocolate Bar', 'price': '2.50', 'quantity': 10}
+        ])
+
+    def test_detail_fields_projection(self):
+        self.authenticate()
+        response = self.client.get(f'/api/sweets/{self.sweet.id}?fields=name')
+        self.assertEqual(response.data, {'name': 'Chocolate Bar'})
+
+    def test_search_projection_with_ranking(self):
+        response = self.client.get('/api/sweets/search?q=milk&fields=price')
+        self.assertEqual(response.data['results'], [{'price': '2.50'}])
+
+    def test_unknown_field_rejected(self):
+        self.authenticate()
+        response = self.client.get('/api/sweets?fields=name,password')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StatelessAuthTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.sweet = Sweet.objects.create(name='Chocolate Bar', category='chocolate',
+                                          price=Decimal('2.50'), quantity=10)
+
+    def login(self, username, password):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return token
+
+    def test_requests_do_not_load_the_user(self):
+        self.login('testuser', 'testpass123')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/sweets/{self.sweet.id}/purchase', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in queries.captured_queries if 'auth_user' in q['sql']])
+
+    def test_admin_claim_authorizes_writes(self):
+        self.login('admin', 'adminpass123')
+        response = self.client.post(f'/api/sweets/{self.sweet.id}/restock', {'quantity': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_change_revokes_issued_tokens(self):
+        self.login('admin', 'adminpass123')
+        self.addCleanup(auth_cache().clear)
+        self.admin.is_staff = False
+        self.admin.save()
+        response = self.client.post(f'/api/sweets/{self.sweet.id}/restock', {'quantity': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revocation_in_the_same_second_as_issue(self):
+        token = self.login('testuser', 'testpass123')
+        self.addCleanup(auth_cache().clear)
+        issued = AccessToken(token)['auth_time']
+        with mock.patch('time.time', return_value=issued):
+            self.user.save()
+        response = self.client.get(f'/api/sweets/{self.sweet.id}')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.login('testuser', 'testpass123')
+        response = self.client.get(f'/api/sweets/{self.sweet.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        Sweet.objects.create(name='Chocolate Bar', description='Milk, dark', category='chocolate',
+                             price=Decimal('2.50'), quantity=100)
+        Sweet.objects.create(name='Gummy Bears', category='candy', price=Decimal('1.50'), quantity=50)
+        self.export_url = '/api/sweets/export'
+
+    def authenticate(self):
+        response = self.client.post('/api/auth/login', {
+            'username': 'testuser',
+            'password': 'testpass123'
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_export_unauthenticated(self):
+        response = self.client.get(self.export_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_export_ndjson_matches_api_representation(self):
+        self.authenticate()
+        response = self.client.get(self.export_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        expected = SweetSerializer(Sweet.objects.order_by('id'), many=True).data
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_export_csv_with_filters(self):
+        self.authenticate()
+        response = self.client.get(self.export_url, {'output': 'csv', 'fields': 'name,price', 'max_price': '2'})
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(list(csv.reader(io.StringIO(body))), [['name', 'price'], ['Gummy Bears', '1.50']])
+
+    def test_export_gzip(self):
+        self.authenticate()
+        response = self.client.get(self.export_url, {'output': 'csv'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertIn('"Milk, dark"', body)
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'api.instrumentation.PerformanceMiddleware'})
+@override_settings(SWEETSHOP_INSTRUMENTATION=True)
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.sweet = Sweet.objects.create(name='Chocolate Bar', category='chocolate',
+                                          price=Decimal('2.50'), quantity=10)
+        latency.reset()
+
+    def authenticate(self, username, password):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_server_timing_header(self):
+        self.authenticate('testuser', 'testpass123')
+        with self.assertLogs('api.performance', 'INFO') as logs:
+            response = self.client.post(f'/api/sweets/{self.sweet.id}/purchase', {'quantity': 1}, format='json')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('view;dur=', timing)
+        self.assertEqual(logs.records[-1].performance['url_name'], 'sweet-purchase')
+
+    def test_metrics_endpoint_reports_per_url_histograms(self):
+        self.authenticate('admin', 'adminpass123')
+        self.client.get('/api/sweets')
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['latency']['sweet-list-create']['count'], 1)
+        self.assertEqual(response.data['latency']['login']['count'], 1)
+
+    def test_metrics_admin_only(self):
+        self.authenticate('testuser', 'testpass123')
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(SWEETSHOP_FEED_LAG_SECONDS=0)
+class ChangeFeedTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.admin = User.objects.create_user(username='admin', password='adminpass123', is_staff=True)
+        self.chocolate = Sweet.objects.create(name='Chocolate Bar', category='chocolate',
+                                              price=Decimal('2.50'), quantity=10)
+        self.gummy = Sweet.objects.create(name='Gummy Bears', category='candy',
+                                          price=Decimal('1.50'), quantity=20)
+        self.changes_url = '/api/sweets/changes'
+
+    def authenticate(self, username='testuser', password='testpass123'):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_changes_unauthenticated(self):
+        response = self.client.get(self.changes_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changes_since_watermark(self):
+        self.authenticate()
+        response = self.client.get(self.changes_url)
+        self.assertEqual([row['name'] for row in response.data['changes']], ['Chocolate Bar', 'Gummy Bears'])
+        self.assertFalse(response.data['has_more'])
+        watermark = response.data['watermark']
+
+        response = self.client.get(self.changes_url, {'since': watermark})
+        self.assertEqual(response.data['changes'], [])
+
+        self.client.post(f'/api/sweets/{self.chocolate.pk}/purchase', {'quantity': 3}, format='json')
+        gummy_pk = self.gummy.pk
+        self.gummy.delete()
+        response = self.client.get(self.changes_url, {'since': watermark, 'fields': 'id,quantity'})
+        self.assertEqual(response.data['changes'], [{'id': self.chocolate.pk, 'quantity': 7}])
+        self.assertEqual(response.data['deleted'], [gummy_pk])
+
+    def test_changes_paginates_with_limit(self):
+        self.authenticate()
+        response = self.client.get(self.changes_url, {'limit': 1})
+        self.assertEqual(len(response.data['changes']), 1)
+        self.assertTrue(response.data['has_more'])
+        response = self.client.get(self.changes_url, {'limit': 1, 'since': response.data['watermark']})
+        self.assertEqual([row['name'] for row in response.data['changes']], ['Gummy Bears'])
+
+    def test_changes_invalid_watermark(self):
+        self.authenticate()
+        response = self.client.get(self.changes_url, {'since': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        naive = encode_watermark(['2024-01-01T00:00:00', 0], ['2024-01-01T00:00:00', 0])
+        response = self.client.get(self.changes_url, {'since': naive})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'since': ['Invalid watermark']})
+
+    @override_settings(SWEETSHOP_FEED_LAG_SECONDS=30)
+    def test_late_commits_are_not_skipped(self):
+        self.authenticate()
+        watermark = self.client.get(self.changes_url).data['watermark']
+        # A writer stamped updated_at before that poll but committed after it.
+        Sweet.objects.filter(pk=self.gummy.pk).update(quantity=5, updated_at=timezone.now() - timedelta(seconds=1))
+        response = self.client.get(self.changes_url, {'since': watermark, 'fields': 'id,quantity'})
+        self.assertIn({'id': self.gummy.pk, 'quantity': 5}, response.data['changes'])
+
+    def test_expired_watermark_asks_for_resync(self):
+        self.authenticate()
+        old = timezone.now() - timedelta(days=31)
+        SweetTombstone.objects.create(sweet_id=999)
+        SweetTombstone.objects.update(deleted_at=old)
+        watermark = encode_watermark([old.isoformat(), 0], [old.isoformat(), 0])
+        response = self.client.get(self.changes_url, {'since': watermark})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+        call_command('prune_tombstones', stdout=io.StringIO())
+        self.assertFalse(SweetTombstone.objects.exists())
+
+    def test_stock_changes_published_on_commit(self):
+        self.authenticate('admin', 'adminpass123')
+        subscriber = broadcaster.subscribe()
+        self.addCleanup(broadcaster.unsubscribe, subscriber)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/sweets/{self.chocolate.pk}/restock', {'quantity': 5}, format='json')
+            self.client.post('/api/sweets/checkout', [{'id': self.gummy.pk, 'quantity': 2}], format='json')
+        events = [subscriber.queue.get_nowait() for _ in range(2)]
+        self.assertEqual([(event['id'], event['quantity']) for event in events],
+                         [(self.chocolate.pk, 15), (self.gummy.pk, 18)])
+
+    def test_stream_rejects_when_full(self):
+        self.authenticate()
+        with mock.patch.object(broadcaster, 'max_subscribers', 0):
+            response = self.client.get('/api/sweets/stream', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class StockBroadcasterTests(TestCase):
+    def test_stream_yields_events_and_keepalives(self):
+        broadcaster = StockBroadcaster()
+        subscriber = broadcaster.subscribe()
+        stream = broadcaster.stream(subscriber, heartbeat=0.01)
+        self.assertTrue(next(stream).startswith('retry:'))
+        broadcaster.publish({'id': 1, 'quantity': 4})
+        self.assertEqual(next(stream), 'id: 1\nevent: stock\ndata: {"id": 1, "quantity": 4}\n\n')
+        self.assertEqual(next(stream), ': keepalive\n\n')
+        stream.close()
+        self.assertEqual(broadcaster._subscribers, set())
+
+    def test_slow_subscriber_is_dropped(self):
+        broadcaster = StockBroadcaster(max_queue=1)
+        subscriber = broadcaster.subscribe()
+        broadcaster.publish({'id': 1})
+        broadcaster.publish({'id': 2})
+        self.assertTrue(subscriber.dropped)
+        self.assertEqual(broadcaster._subscribers, set())
+        stream = broadcaster.stream(subscriber)
+        self.assertEqual(list(stream)[-1], 'event: dropped\ndata: {}\n\n')
+
+
+class InventoryLedgerTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.admin = User.objects.create_user(username='admin', password='adminpass123', is_staff=True)
+        self.chocolate = Sweet.objects.create(name='Chocolate Bar', category='chocolate',
+                                              price=Decimal('2.50'), quantity=10)
+        self.truffle = Sweet.objects.create(name='Truffle', category='chocolate',
+                                            price=Decimal('4.00'), quantity=10)
+        self.stats_url = '/api/sweets/stats'
+
+    def authenticate(self, username='testuser', password='testpass123'):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_purchase_and_restock_append_events(self):
+        self.authenticate()
+        self.client.post(f'/api/sweets/{self.chocolate.pk}/purchase', {'quantity': 3}, format='json')
+        self.client.post(f'/api/sweets/{self.chocolate.pk}/purchase', {'quantity': 50}, format='json')
+        self.authenticate('admin', 'adminpass123')
+        self.client.post(f'/api/sweets/{self.chocolate.pk}/restock', {'quantity': 5}, format='json')
+
+        events = list(InventoryEvent.objects.order_by('id').values_list('sweet_id', 'delta', 'kind', 'user_id'))
+        self.assertEqual(events, [
+            (self.chocolate.pk, -3, 'purchase', self.user.pk),
+            (self.chocolate.pk, 5, 'restock', self.admin.pk),
+        ])
+
+    def test_rollups_accumulate_per_sweet_and_category(self):
+        self.authenticate()
+        self.client.post(f'/api/sweets/{self.chocolate.pk}/purchase', {'quantity': 2}, format='json')
+        self.client.post('/api/sweets/checkout', [
+            {'id': self.chocolate.pk, 'quantity': 1},
+            {'id': self.truffle.pk, 'quantity': 3},
+        ], format='json')
+
+        rollup = SweetSalesRollup.objects.get(period='day', sweet=self.chocolate)
+        self.assertEqual((rollup.sold, rollup.revenue), (3, Decimal('7.50')))
+        for period in ('hour', 'day'):
+            rollup = CategorySalesRollup.objects.get(period=period, category='chocolate')
+            self.assertEqual((rollup.sold, rollup.restocked, rollup.revenue), (6, 0, Decimal('19.50')))
+
+    def test_rollups_upsert_in_one_statement_per_table(self):
+        with self.assertNumQueries(3):
+            record_stock_changes([(self.chocolate, -2), (self.truffle, -1)], InventoryEvent.PURCHASE)
+        # Databases without ON CONFLICT add to the same rows with INSERT OR IGNORE + UPDATE.
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            record_stock_changes([(self.chocolate, -1)], InventoryEvent.PURCHASE)
+        record_stock_changes([(self.chocolate, 4)], InventoryEvent.RESTOCK)
+
+        for period in ('hour', 'day'):
+            rollup = SweetSalesRollup.objects.get(period=period, sweet=self.chocolate)
+            self.assertEqual((rollup.sold, rollup.restocked, rollup.revenue), (3, 4, Decimal('7.50')))
+            rollup = CategorySalesRollup.objects.get(period=period, category='chocolate')
+            self.assertEqual((rollup.sold, rollup.restocked, rollup.revenue), (4, 4, Decimal('11.50')))
+
+    def test_stats_reads_rollups(self):
+        self.authenticate()
+        self.client.post('/api/sweets/checkout', [
+            {'id': self.chocolate.pk, 'quantity': 1},
+            {'id': self.truffle.pk, 'quantity': 3},
+        ], format='json')
+        self.authenticate('admin', 'adminpass123')
+        response = self.client.get(self.stats_url, {'period': 'hour', 'group': 'sweet'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals'], [
+            {'sweet': self.truffle.pk, 'sold': 3, 'restocked': 0, 'revenue': '12.00'},
+            {'sweet': self.chocolate.pk, 'sold': 1, 'restocked': 0, 'revenue': '2.50'},
+        ])
+        self.assertEqual(len(response.data['buckets']), 2)
+
+        response = self.client.get(self.stats_url, {'since': '2000-01-01', 'until': '2000-01-02'})
+        self.assertEqual(response.data['totals'], [])
+
+    def test_stats_admin_only_and_validates(self):
+        self.authenticate()
+        response = self.client.get(self.stats_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.authenticate('admin', 'adminpass123')
+        response = self.client.get(self.stats_url, {'period': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.stats_url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.stats_url, {'group': 'sweet', 'sweet': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ShardedStockTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.admin = User.objects.create_user(username='admin', password='adminpass123', is_staff=True)
+        self.sweet = Sweet.objects.create(name='Flash Fudge', category='other',
+                                          price=Decimal('1.00'), quantity=10)
+        self.sweet.shard_stock(4)
+
+    def authenticate(self, username='testuser', password='testpass123'):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def shard_quantities(self):
+        return list(StockShard.objects.filter(sweet=self.sweet).order_by('index').values_list('quantity', flat=True))
+
+    def test_rollups_are_sharded_too(self):
+        self.authenticate()
+        with mock.patch('random.randrange', side_effect=[0, 0, 1, 1, 2, 2]):
+            for _ in range(3):
+                self.client.post(f'/api/sweets/{self.sweet.pk}/purchase', {'quantity': 1}, format='json')
+        self.assertEqual(sorted(SweetSalesRollup.objects.filter(period='day').values_list('shard', 'sold')),
+                         [(0, 1), (1, 1), (2, 1)])
+        self.assertEqual(CategorySalesRollup.objects.filter(period='hour').count(), 3)
+
+        self.authenticate('admin', 'adminpass123')
+        response = self.client.get('/api/sweets/stats', {'period': 'hour', 'group': 'category'})
+        self.assertEqual(response.data['totals'], [{'category': 'other', 'sold': 3, 'restocked': 0, 'revenue': '3.00'}])
+        self.assertEqual([bucket['sold'] for bucket in response.data['buckets']], [3])
+
+    def test_shard_stock_splits_total(self):
+        self.assertEqual(self.shard_quantities(), [3, 3, 2, 2])
+        self.assertEqual((self.sweet.quantity, self.sweet.total_quantity), (0, 10))
+        self.sweet.shard_stock(0)
+        self.assertEqual((self.sweet.quantity, self.shard_quantities()), (10, []))
+
+    def test_purchase_reports_total(self):
+        self.authenticate()
+        response = self.client.post(f'/api/sweets/{self.sweet.pk}/purchase', {'quantity': 2}, format='json')
+        self.assertEqual(response.data['sweet']['quantity'], 8)
+        self.assertEqual(sum(self.shard_quantities()), 8)
+        response = self.client.get(f'/api/sweets/{self.sweet.pk}')
+        self.assertEqual(response.data['quantity'], 8)
+        response = self.client.get('/api/sweets', {'fields': 'name,quantity'})
+        self.assertEqual(response.data['results'], [{'name': 'Flash Fudge', 'quantity': 8}])
+
+    def test_purchase_spans_shards_without_overselling(self):
+        self.authenticate()
+        response = self.client.post(f'/api/sweets/{self.sweet.pk}/purchase', {'quantity': 9}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sum(self.shard_quantities()), 1)
+        response = self.client.post(f'/api/sweets/{self.sweet.pk}/purchase', {'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Not enough stock. Available: 1')
+
+    def test_checkout_with_sharded_line(self):
+        plain = Sweet.objects.create(name='Plain Toffee', category='other', price=Decimal('1.00'), quantity=5)
+        self.authenticate()
+        response = self.client.post('/api/sweets/checkout', [
+            {'id': self.sweet.pk, 'quantity': 4},
+            {'id': plain.pk, 'quantity': 5},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([sweet['quantity'] for sweet in response.data['sweets']], [6, 0])
+
+        response = self.client.post('/api/sweets/checkout', [{'id': self.sweet.pk, 'quantity': 7}], format='json')
+        self.assertEqual(response.data['available'], {self.sweet.pk: 6})
+
+    def test_restock_spreads_over_shards(self):
+        before = self.shard_quantities()
+        self.authenticate('admin', 'adminpass123')
+        response = self.client.post(f'/api/sweets/{self.sweet.pk}/restock', {'quantity': 6}, format='json')
+        self.assertEqual(response.data['sweet']['quantity'], 16)
+        added = [after - before for after, before in zip(self.shard_quantities(), before)]
+        self.assertEqual(sorted(added), [1, 1, 2, 2])
+
+
+    @override_settings(SWEETSHOP_FEED_LAG_SECONDS=0)
+    def test_change_feed_reports_sharded_purchases(self):
+        self.authenticate()
+        watermark = self.client.get('/api/sweets/changes').data['watermark']
+        self.client.post(f'/api/sweets/{self.sweet.pk}/purchase', {'quantity': 2}, format='json')
+        response = self.client.get('/api/sweets/changes', {'since': watermark, 'fields': 'id,quantity'})
+        self.assertEqual(response.data['changes'], [{'id': self.sweet.pk, 'quantity': 8}])
+
+        watermark = response.data['watermark']
+        response = self.client.get('/api/sweets/changes', {'since': watermark})
+        self.assertEqual(response.data['changes'], [])
+
+    def test_import_reshards_only_rows_with_quantity(self):
+        self.authenticate('admin', 'adminpass123')
+        response = self.client.generic('POST', '/api/sweets/import', 'name,price\nFlash Fudge,2.00\n',
+                                       content_type='text/csv')
+        self.assertEqual(response.data['updated'], 1)
+        self.sweet.refresh_from_db()
+        self.assertEqual((self.sweet.price, self.sweet.total_quantity), (Decimal('2.00'), 10))
+
+        self.client.generic('POST', '/api/sweets/import', '{"name": "Flash Fudge", "price": "2.00", "quantity": 12}\n',
+                            content_type='application/x-ndjson')
+        self.sweet.refresh_from_db()
+        self.assertEqual((self.sweet.quantity, self.shard_quantities()), (0, [3, 3, 3, 3]))
+
+class SQLiteProfileTests(SimpleTestCase):
+    # The connections under test point at their own temporary file.
+    databases = {'default'}
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self.connect(sqlite_databases(self.path))
+
+    def connect(self, databases):
+        self.connections = ConnectionHandler(databases)
+        self.addCleanup(self.connections.close_all)
+
+    def pragma(self, alias, name):
+        with self.connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_primary_pragmas(self):
+        self.assertEqual(self.pragma('default', 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma('default', 'synchronous'), 1)
+        self.assertEqual(self.pragma('default', 'busy_timeout'), 20000)
+        self.assertIsNone(self.connections['default'].settings_dict['CONN_MAX_AGE'])
+
+    def test_pragmas_before_django_5_1(self):
+        # Django < 5.1 has neither init_command nor transaction_mode and
+        # would hand them to sqlite3.connect().
+        with mock.patch.object(django, 'VERSION', (5, 0, 0, 'final', 0)):
+            databases = sqlite_databases(self.path)
+        for database in databases.values():
+            self.assertEqual(set(database['OPTIONS']), {'timeout'})
+        self.connect(databases)
+        self.assertEqual(self.pragma('default', 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma('default', 'synchronous'), 1)
+        self.assertEqual(self.pragma('replica', 'query_only'), 1)
+
+    def test_read_alias_is_query_only(self):
+        with self.connections['default'].cursor() as cursor:
+            cursor.execute('CREATE TABLE t (x INTEGER)')
+        with self.assertRaises(OperationalError):
+            with self.connections['replica'].cursor() as cursor:
+                cursor.execute('INSERT INTO t VALUES (1)')
+
+
+@override_settings(SWEETSHOP_READ_DATABASE='replica')
+class ReadReplicaRouterTests(SimpleTestCase):
+    def route(self, method):
+        router = ReadReplicaRouter()
+        middleware = ReadReplicaMiddleware(lambda request: (router.db_for_read(Sweet), router.db_for_write(Sweet)))
+        return middleware(getattr(RequestFactory(), method)('/api/sweets'))
+
+    def test_safe_methods_read_from_replica(self):
+        self.assertEqual(self.route('get'), ('replica', 'default'))
+        self.assertEqual(self.route('head'), ('replica', 'default'))
+
+    def test_unsafe_methods_stay_on_primary(self):
+        self.assertEqual(self.route('post'), (None, 'default'))
+        self.assertIsNone(ReadReplicaRouter().db_for_read(Sweet))
+
+    def test_no_migrations_on_replica(self):
+        self.assertFalse(ReadReplicaRouter().allow_migrate('replica', 'api'))
+        self.assertIsNone(ReadReplicaRouter().allow_migrate('default', 'api'))
+
+
+class HashingPoolTests(APITestCase):
+    def test_rejects_when_saturated(self):
+        pool = HashingPool(workers=1, max_pending=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        threads = [threading.Thread(target=pool.run, args=(block,)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        time.sleep(0.05)
+        with self.assertRaises(HashingBusy):
+            pool.run(lambda: None)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(pool.run(lambda: 'done'), 'done')
+
+    def test_login_and_register_fail_fast_when_busy(self):
+        User.objects.create_user(username='testuser', password='testpass123')
+        with mock.patch('api.hashing.HashingPool.run', side_effect=HashingBusy):
+            response = self.client.post('/api/auth/login', {
+                'username': 'testuser', 'password': 'testpass123'
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+            response = self.client.post('/api/auth/register', {
+                'username': 'newuser', 'password': 'newpass123', 'password_confirm': 'newpass123'
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_login_upgrades_outdated_hash(self):
+        user = User.objects.create_user(username='testuser')
+        user.password = make_password('testpass123', hasher='md5')
+        user.save()
+        response = self.client.post('/api/auth/login', {
+            'username': 'testuser', 'password': 'testpass123'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+        self.assertTrue(user.check_password('testpass123'))
+
+
+class FacetTests(APITestCase):
+    def setUp(self):
+        Sweet.objects.create(name='Chocolate Bar', category='chocolate', price=Decimal('2.50'), quantity=100)
+        Sweet.objects.create(name='Chocolate Cake', category='cake', price=Decimal('15.00'), quantity=10)
+        Sweet.objects.create(name='Gummy Bears', category='candy', price=Decimal('0.50'), quantity=50)
+        self.search_url = '/api/sweets/search'
+        catalog_cache.bump()
+
+    def counts(self, facet):
+        return {entry.get('value', entry.get('min')): entry['count'] for entry in facet if entry['count']}
+
+    def test_facets_follow_filters(self):
+        response = self.client.get(self.search_url, {'name': 'chocolate', 'facets': 'category,price'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        facets = response.data['facets']
+        self.assertEqual(self.counts(facets['category']), {'chocolate': 1, 'cake': 1})
+        self.assertEqual(len(facets['category']), len(Sweet.CATEGORY_CHOICES))
+        self.assertEqual(self.counts(facets['price']), {'2.00': 1, '10.00': 1})
+
+    def test_each_facet_ignores_its_own_filter(self):
+        response = self.client.get(self.search_url, {'category': 'candy', 'max_price': '5', 'facets': 'category,price'})
+        self.assertEqual([row['name'] for row in response.data['results']], ['Gummy Bears'])
+        self.assertEqual(self.counts(response.data['facets']['category']), {'chocolate': 1, 'candy': 1})
+        self.assertEqual(self.counts(response.data['facets']['price']), {None: 1})
+
+    def test_facets_cached_until_catalog_changes(self):
+        self.client.get(self.search_url, {'facets': 'category', 'page_size': 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.search_url, {'facets': 'category', 'page_size': 2})
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(self.counts(response.data['facets']['category'])['candy'], 1)
+
+        Sweet.objects.create(name='Sour Worms', category='candy', price=Decimal('1.00'), quantity=5)
+        response = self.client.get(self.search_url, {'facets': 'category', 'page_size': 2})
+        self.assertEqual(self.counts(response.data['facets']['category'])['candy'], 2)
+
+    def test_unknown_facet(self):
+        response = self.client.get(self.search_url, {'facets': 'colour'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(Image, 'Pillow is not installed')
+class SweetImageTests(APITestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        storage = override_settings(SWEETSHOP_IMAGE_WORKERS=0, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': self.media}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storage.enable()
+        self.addCleanup(storage.disable)
+        self.admin = User.objects.create_user(username='admin', password='adminpass123', is_staff=True)
+        self.sweet = Sweet.objects.create(name='Chocolate Bar', category='chocolate', price=Decimal('2.50'), quantity=10)
+
+    def authenticate(self):
+        response = self.client.post('/api/auth/login', {
+            'username': 'admin',
+            'password': 'adminpass123'
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def png(self, colour=(200, 80, 40, 255)):
+        buffer = io.BytesIO()
+        Image.new('RGBA', (2000, 1000), colour).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def upload(self, sweet, data):
+        return self.client.post(f'/api/sweets/{sweet.pk}/image', data, content_type='image/png')
+
+    def stored_files(self):
+        return sorted(path.name for path in Path(self.media).rglob('*') if path.is_file())
+
+    def test_upload_renders_variants(self):
+        self.authenticate()
+        response = self.upload(self.sweet, self.png())
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(len(self.stored_files()), 6)
+
+        response = self.client.get(f'/api/sweets/{self.sweet.pk}')
+        images = response.data['images']
+        self.assertEqual(set(images), {'thumb', 'card', 'full'})
+        self.assertEqual(response.data['image'], images['full']['jpeg'])
+        name = images['thumb']['webp'].split('/api/media/', 1)[1]
+        with image_storage().open(name) as file:
+            self.assertEqual(Image.open(file).size, (160, 80))
+
+    def test_identical_upload_is_deduplicated(self):
+        other = Sweet.objects.create(name='Truffle', category='chocolate', price=Decimal('4.00'), quantity=5)
+        self.authenticate()
+        first = self.upload(self.sweet, self.png())
+        files = self.stored_files()
+        second = self.upload(other, self.png())
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data['hash'], first.data['hash'])
+        self.assertEqual(self.stored_files(), files)
+
+    def test_variants_served_immutable(self):
+        self.authenticate()
+        url = self.upload(self.sweet, self.png()).data['images']['card']['webp']
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get('/api/media/sweets/../settings.py').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_raw_upload_limit_is_the_image_limit(self):
+        self.authenticate()
+        data = self.png()
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=len(data) // 2):
+            response = self.upload(self.sweet, data)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        with mock.patch.object(image_pipeline, 'MAX_UPLOAD_BYTES', len(data) - 1):
+            response = self.upload(self.sweet, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rejects_non_images(self):
+        self.authenticate()
+        response = self.upload(self.sweet, b'not an image')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stored_files(), [])
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='otherpass123')
+        self.sweet = Sweet.objects.create(name='Chocolate Bar', category='chocolate', price=Decimal('2.50'), quantity=10)
+        self.purchase_url = f'/api/sweets/{self.sweet.pk}/purchase'
+        self.addCleanup(idempotency_store.clear)
+
+    def authenticate(self, username='testuser', password='testpass123'):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def purchase(self, quantity=2, key='order-1'):
+        return self.client.post(self.purchase_url, {'quantity': quantity}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_without_touching_stock(self):
+        self.authenticate()
+        first = self.purchase()
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.purchase()
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(any('api_sweet' in query['sql'] for query in queries.captured_queries))
+        self.sweet.refresh_from_db()
+        self.assertEqual(self.sweet.quantity, 8)
+
+    def test_key_reused_for_different_request(self):
+        self.authenticate()
+        self.purchase(quantity=2)
+        response = self.purchase(quantity=3)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_keys_are_scoped_per_user(self):
+        self.authenticate()
+        self.purchase()
+        self.authenticate('other', 'otherpass123')
+        response = self.purchase()
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.sweet.refresh_from_db()
+        self.assertEqual(self.sweet.quantity, 6)
+
+    def test_without_key_every_request_runs(self):
+        self.authenticate()
+        self.client.post(self.purchase_url, {'quantity': 1}, format='json')
+        self.client.post(self.purchase_url, {'quantity': 1}, format='json')
+        self.sweet.refresh_from_db()
+        self.assertEqual(self.sweet.quantity, 8)
+
+    def test_concurrent_requests_are_coalesced(self):
+        store = IdempotencyStore()
+        calls = []
+
+        def view():
+            calls.append(1)
+            time.sleep(0.1)
+            return Response({'ok': True}, status=status.HTTP_200_OK)
+
+        responses = []
+        threads = [
+            threading.Thread(target=lambda: responses.append(store.run('key', 'fp', view)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response.data for response in responses], [{'ok': True}] * 4)
+
+
+class SuggestTests(APITestCase):
+    def setUp(self):
+        suggest_index.reset()
+        self.addCleanup(suggest_index.reset)
+        self.bar = Sweet.objects.create(name='Chocolate Bar', category='chocolate', price=Decimal('2.50'), quantity=10)
+        Sweet.objects.create(name='Chocolate Cake', category='cake', price=Decimal('15.00'), quantity=5)
+        Sweet.objects.create(name='Dark Chocolate Truffle', category='chocolate', price=Decimal('4.00'), quantity=5)
+        Sweet.objects.create(name='Crème Brûlée', category='pastry', price=Decimal('5.00'), quantity=5)
+        self.suggest_url = '/api/sweets/suggest'
+
+    def names(self, **params):
+        response = self.client.get(self.suggest_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['name'] for row in response.data['results']]
+
+    def test_prefix_matches_names_then_words(self):
+        self.assertEqual(self.names(prefix='choc'), ['Chocolate Bar', 'Chocolate Cake', 'Dark Chocolate Truffle'])
+        self.assertEqual(self.names(prefix='CHOCOLATE  c'), ['Chocolate Cake'])
+        self.assertEqual(self.names(prefix='creme'), ['Crème Brûlée'])
+        self.assertEqual(self.names(prefix=''), [])
+
+    def test_limit_and_category(self):
+        self.assertEqual(self.names(prefix='choc', limit=1), ['Chocolate Bar'])
+        self.assertEqual(self.names(prefix='choc', category='chocolate'), ['Chocolate Bar', 'Dark Chocolate Truffle'])
+
+    def test_no_queries_once_built(self):
+        self.names(prefix='c')
+        with self.assertNumQueries(0):
+            self.names(prefix='cho')
+
+    def test_index_follows_writes(self):
+        self.names(prefix='c')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bar.name = 'Caramel Bar'
+            self.bar.save()
+            Sweet.objects.create(name='Choc Chip Cookie', category='cookie', price=Decimal('1.00'), quantity=5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(prefix='choc'), ['Choc Chip Cookie', 'Chocolate Cake', 'Dark Chocolate Truffle'])
+            self.assertEqual(self.names(prefix='bar'), ['Caramel Bar'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bar.delete()
+        self.assertEqual(self.names(prefix='caramel'), [])
+
+    def test_rebuilds_after_bulk_writes(self):
+        self.names(prefix='c')
+        Sweet.objects.bulk_create([Sweet(name='Cherry Drops', category='candy', price=Decimal('1.00'))])
+        suggest_index.invalidate()
+        self.assertEqual(self.names(prefix='cher'), ['Cherry Drops'])
+
+
+class BulkOperationTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='adminpass123', is_staff=True)
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.cake = Sweet.objects.create(name='Sponge Cake', category='cake', price=Decimal('10.00'), quantity=5)
+        self.cheesecake = Sweet.objects.create(name='Cheesecake', category='cake', price=Decimal('3.35'), quantity=0)
+        self.bar = Sweet.objects.create(name='Chocolate Bar', category='chocolate', price=Decimal('2.50'), quantity=10)
+        self.price_url = '/api/sweets/bulk/price'
+        self.restock_url = '/api/sweets/bulk/restock'
+        self.addCleanup(idempotency_store.clear)
+
+    def authenticate(self, username='admin', password='adminpass123'):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def prices(self):
+        return dict(Sweet.objects.values_list('name', 'price'))
+
+    def test_percentage_markdown_is_one_update(self):
+        self.authenticate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'{self.price_url}?category=cake', {'percent': '-15'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "api_sweet"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.prices(), {
+            'Sponge Cake': Decimal('8.50'), 'Cheesecake': Decimal('2.85'), 'Chocolate Bar': Decimal('2.50'),
+        })
+
+    def test_absolute_change_and_validation(self):
+        self.authenticate()
+        response = self.client.post(f'{self.price_url}?max_price=5', {'amount': '0.50'}, format='json')
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(self.prices()['Chocolate Bar'], Decimal('3.00'))
+
+        response = self.client.post(self.price_url, {'amount': '-5'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.price_url, {'amount': '1', 'percent': '5'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.prices()['Sponge Cake'], Decimal('10.00'))
+
+    def test_prices_cannot_outgrow_the_column(self):
+        self.authenticate()
+        response = self.client.post(self.price_url, {'amount': '99999999.99'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('3 sweet(s)', response.data['error'])
+
+        Sweet.objects.filter(pk=self.cake.pk).update(price=Decimal('9999999.99'))
+        response = self.client.post(self.price_url, {'percent': '1000'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('1 sweet(s)', response.data['error'])
+        self.assertEqual(self.prices()['Chocolate Bar'], Decimal('2.50'))
+
+        response = self.client.post(f'{self.price_url}?category=chocolate', {'percent': '1000'}, format='json')
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(self.client.get('/api/sweets').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.prices()['Chocolate Bar'], Decimal('27.50'))
+
+    def test_dry_run_changes_nothing(self):
+        self.authenticate()
+        response = self.client.post(f'{self.price_url}?category=cake', {'percent': '10', 'dry_run': True},
+                                    format='json')
+        self.assertEqual(response.data, {'dry_run': True, 'matched': 2})
+        response = self.client.post(self.restock_url, {'quantity': 5, 'dry_run': True}, format='json')
+        self.assertEqual(response.data, {'dry_run': True, 'matched': 3})
+        self.assertEqual(self.prices()['Sponge Cake'], Decimal('10.00'))
+        self.assertEqual(InventoryEvent.objects.count(), 0)
+
+    def test_restock_includes_sharded_sweets_and_ledger(self):
+        self.cake.shard_stock(2)
+        self.authenticate()
+        response = self.client.post(f'{self.restock_url}?category=cake', {'quantity': 4}, format='json')
+        self.assertEqual(response.data['updated'], 2)
+        self.cake.refresh_from_db()
+        self.cheesecake.refresh_from_db()
+        self.assertEqual(self.cake.total_quantity, 9)
+        self.assertEqual(self.cheesecake.quantity, 4)
+        self.assertEqual(sorted(InventoryEvent.objects.values_list('sweet_id', 'delta')),
+                         [(self.cake.pk, 4), (self.cheesecake.pk, 4)])
+        self.assertEqual(CategorySalesRollup.objects.filter(category='cake', period='day')
+                         .aggregate(restocked=Sum('restocked'))['restocked'], 8)
+
+    def test_admin_only(self):
+        self.authenticate('testuser', 'testpass123')
+        response = self.client.post(self.restock_url, {'quantity': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class WireFormatTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.sweet = Sweet.objects.create(name='Line\u2028Sep Bar é', category='chocolate',
+                                          price=Decimal('2.50'), quantity=10)
+
+    def authenticate(self):
+        response = self.client.post('/api/auth/login', {
+            'username': 'testuser',
+            'password': 'testpass123'
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    @skipUnless(orjson, 'orjson is not installed')
+    def test_orjson_output_matches_json_renderer(self):
+        data = {
+            'sweet': SweetSerializer(self.sweet).data,
+            'values': SweetValuesSerializer().many(SweetValuesSerializer().values(Sweet.objects.all())),
+            'raw': {'price': Decimal('2.50'), 'at': self.sweet.created_at, 1: ['\u2029', None, True, 1.5]},
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack_negotiation(self):
+        self.authenticate()
+        response = self.client.get('/api/sweets', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        body = msgpack.unpackb(response.content)
+        self.assertEqual(body['results'], json.loads(JSONRenderer().render(response.data))['results'])
+        self.assertEqual(body['results'][0]['price'], '2.50')
+
+        response = self.client.post(f'/api/sweets/{self.sweet.pk}/purchase', msgpack.packb({'quantity': 3}),
+                                    content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(msgpack.unpackb(response.content)['sweet']['quantity'], 7)
+
+    def test_malformed_bodies_are_rejected(self):
+        self.authenticate()
+        url = f'/api/sweets/{self.sweet.pk}/purchase'
+        response = self.client.post(url, b'{"quantity": NaN}', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        if msgpack:
+            response = self.client.post(url, b'\xc1', content_type='application/msgpack')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReservationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='otherpass123')
+        self.sweet = Sweet.objects.create(name='Chocolate Bar', category='chocolate', price=Decimal('2.50'), quantity=10)
+        self.addCleanup(idempotency_store.clear)
+
+    def authenticate(self, username='testuser', password='testpass123'):
+        response = self.client.post('/api/auth/login', {
+            'username': username,
+            'password': password
+        }, format='json')
+        token = response.data['tokens']['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def reserve(self, quantity, sweet=None):
+        sweet = sweet or self.sweet
+        return self.client.post(f'/api/sweets/{sweet.pk}/reserve', {'quantity': quantity}, format='json')
+
+    def test_holds_reduce_available_stock(self):
+        self.authenticate()
+        response = self.reserve(6)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['sweet']['available'], 4)
+        self.assertEqual(self.client.get(f'/api/sweets/{self.sweet.pk}').data['available'], 4)
+
+        self.assertEqual(self.reserve(5).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f'/api/sweets/{self.sweet.pk}/purchase', {'quantity': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Available: 4', response.data['error'])
+
+    def test_purchase_converts_hold_once(self):
+        self.authenticate()
+        reservation = self.reserve(3).data['reservation']
+        url = f"/api/reservations/{reservation['id']}/purchase"
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['sweet']['quantity'], 7)
+        self.assertEqual(response.data['sweet']['available'], 7)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(InventoryEvent.objects.get().delta, -3)
+
+    def test_cancel_and_ownership(self):
+        self.authenticate()
+        reservation = self.reserve(4).data['reservation']
+        url = f"/api/reservations/{reservation['id']}"
+        self.authenticate('other', 'otherpass123')
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.authenticate()
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.sweet.refresh_from_db()
+        self.assertEqual((self.sweet.quantity, self.sweet.reserved), (10, 0))
+
+    def test_sweeper_releases_expired_holds_in_bulk(self):
+        bar = Sweet.objects.create(name='Toffee', category='candy', price=Decimal('1.00'), quantity=10)
+        for sweet, quantity in ((self.sweet, 2), (self.sweet, 3), (bar, 4)):
+            reserve(sweet.pk, self.user.pk, quantity)
+        live = reserve(bar.pk, self.user.pk, 1)
+        Reservation.objects.exclude(pk=live.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(claim(Reservation.objects.exclude(pk=live.pk).first().pk, self.user.pk))
+
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('sweep_reservations', '--batch-size', '10', stdout=out)
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual([sql for sql in statements if 'SAVEPOINT' not in sql and sql != 'RELEASE'],
+                         ['SELECT', 'DELETE', 'UPDATE'])
+        self.assertIn('Released 3', out.getvalue())
+        self.assertEqual(dict(Sweet.objects.values_list('name', 'reserved')), {'Chocolate Bar': 0, 'Toffee': 1})
+        self.assertEqual(list(Reservation.objects.values_list('pk', flat=True)), [live.pk])
+
+    def test_sweeper_does_not_release_holds_another_sweeper_deleted(self):
+        first = reserve(self.sweet.pk, self.user.pk, 2)
+        reserve(self.sweet.pk, self.user.pk, 3)
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        other_sweeper = []
+
+        def delete_first_hold_after_select(execute, sql, params, many, context):
+            # A second sweeper deletes and releases a hold right after this
+            # one has read it.
+            result = execute(sql, params, many, context)
+            if sql.startswith('SELECT') and 'api_reservation' in sql and not other_sweeper:
+                other_sweeper.append(first.pk)
+                Reservation.objects.filter(pk=first.pk).delete()
+                Sweet.objects.release_reserved({self.sweet.pk: first.quantity})
+            return result
+
+        with connection.execute_wrapper(delete_first_hold_after_select):
+            released = release_expired()
+        self.assertEqual((other_sweeper, released), ([first.pk], 1))
+        self.sweet.refresh_from_db()
+        self.assertEqual(self.sweet.reserved, 0)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_sweeper_warns_about_a_process_local_catalog_cache(self):
+        err = io.StringIO()
+        call_command('sweep_reservations', stdout=io.StringIO(), stderr=err)
+        self.assertIn('SWEETSHOP_CATALOG_CACHE is not a shared cache backend', err.getvalue())
+
+        err = io.StringIO()
+        with mock.patch.object(catalog_cache, '_backend', DummyCache('shared', {})):
+            call_command('sweep_reservations', stdout=io.StringIO(), stderr=err)
+        self.assertEqual(err.getvalue(), '')
+
+    def test_sharded_sweets_cannot_be_reserved(self):
+        self.sweet.shard_stock(2)
+        self.authenticate()
+        self.assertEqual(self.reserve(1).status_code, status.HTTP_409_CONFLICT)
+
+    def test_sweets_with_holds_cannot_be_sharded(self):
+        reserve(self.sweet.pk, self.user.pk, 3)
+        with self.assertRaises(ReservedStockError):
+            self.sweet.shard_stock(4)
+        with self.assertRaisesMessage(CommandError, '3 reserved'):
+            call_command('shard_stock', self.sweet.pk, 4, stdout=io.StringIO())
+        self.sweet.refresh_from_db()
+        self.assertEqual((self.sweet.shard_count, self.sweet.quantity, self.sweet.reserved), (0, 10, 3))
+        self.assertFalse(StockShard.objects.filter(sweet=self.sweet).exists())
+
+        # A hold placed between the read and the write is caught by the
+        # guarded UPDATE.
+        Reservation.objects.all().delete()
+        Sweet.objects.filter(pk=self.sweet.pk).update(reserved=0)
+        bulk_create = StockShard.objects.bulk_create
+
+        def hold_then_create(shards, **kwargs):
+            Sweet.objects.filter(pk=self.sweet.pk).update(reserved=1)
+            return bulk_create(shards, **kwargs)
+
+        with mock.patch.object(StockShard.objects, 'bulk_create', hold_then_create):
+            with self.assertRaises(ReservedStockError):
+                self.sweet.shard_stock(4)
+        self.assertFalse(StockShard.objects.filter(sweet=self.sweet).exists())
+
+
+class BenchmarkToolTests(TestCase):
+    def test_generate_catalog(self):
+        out = io.StringIO()
+        call_command('generate_catalog', '--sweets', '30', '--users', '3', '--batch-size', '7', stdout=out)
+        call_command('generate_catalog', '--sweets', '5', '--users', '1', '--admins', '0', stdout=out)
+        self.assertEqual(Sweet.objects.count(), 35)
+        self.assertEqual(Sweet.objects.values('name').distinct().count(), 35)
+        self.assertEqual(User.objects.filter(username__startswith='bench-user-').count(), 4)
+        self.assertTrue(User.objects.get(username='bench-admin-0').is_staff)
+        self.assertTrue(User.objects.get(username='bench-user-3').check_password('bench-password'))
+
+    def test_baseline_comparison(self):
+        def run(p95, queries, throughput, requests=100):
+            return {
+                'throughput': throughput,
+                'operations': {'detail': {'requests': requests, 'p95_ms': p95, 'queries': queries, 'error_rate': 0.0}},
+            }
+
+        baseline = run(10.0, 2.0, 500)
+        self.assertEqual(compare_to_baseline(run(11.0, 2.0, 450), baseline, 0.2), [])
+        self.assertEqual(len(compare_to_baseline(run(20.0, 3.0, 300), baseline, 0.2)), 3)
+        self.assertEqual(compare_to_baseline(run(20.0, 2.0, 500, requests=5), baseline, 0.2), [])
+        self.assertEqual(compare_to_baseline({'throughput': 500, 'operations': {}}, baseline, 0.2),
+                         ['detail: no requests completed (baseline 100)'])
+
+    def test_bench_api_fails_instead_of_measuring_errors(self):
+        with override_settings(ALLOWED_HOSTS=['.shop.example', 'localhost']):
+            self.assertEqual(bench_api.request_host(), 'shop.example')
+        with override_settings(ALLOWED_HOSTS=['*']):
+            self.assertEqual(bench_api.request_host(), 'testserver')
+
+        def crash(index):
+            raise DisallowedHost('testserver')
+
+        with self.assertRaises(DisallowedHost):
+            run_concurrently(crash, 2)
+
+        failed = {'throughput': 0, 'requests': 3,
+                  'operations': {'detail': {'requests': 3, 'throughput': 1, 'p50_ms': 1, 'p95_ms': 1, 'p99_ms': 1,
+                                            'queries': 0, 'error_rate': 1.0}}}
+        with mock.patch.object(bench_api, 'benchmark_database', nullcontext), \
+                mock.patch.object(bench_api.Command, 'run', return_value=failed), \
+                self.assertRaisesMessage(CommandError, 'Every detail request failed'):
+            call_command('bench_api', '--sweets', '1', '--users', '1', stdout=io.StringIO())
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            json.dump({'config': {'sweets': 5}, 'operations': {}, 'throughput': 1}, file)
+            file.flush()
+            with self.assertRaisesMessage(CommandError, 'different options'):
+                call_command('bench_api', '--baseline', file.name, stdout=io.StringIO())
+
+    def test_bench_search_bypasses_catalog_cache(self):
+        catalog_cache.invalidate()
+        hits = catalog_cache.hits
+        out = io.StringIO()
+        # The test database stands in for the throwaway benchmark copy.
+        with mock.patch.object(bench_search, 'benchmark_database', nullcontext):
+            call_command('bench_search', '--size', '40', '--page-size', '5', '--repeat', '3', stdout=out)
+        self.assertIn('no match', out.getvalue())
+        self.assertEqual(catalog_cache.hits, hits)
+
+    def test_bench_pagination_runs_every_variant(self):
+        out = io.StringIO()
+        with mock.patch.object(bench_pagination, 'benchmark_database', nullcontext):
+            call_command('bench_pagination', '--sizes', '20', '60', '--page-size', '5', '--repeat', '1',
+                         '--full-max', '60', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        for label in ('unpaginated', 'offset middle', 'keyset middle'):
+            self.assertIn(label, lines[1])
@@ -4,9 +4,25 @@ from . import views
 urlpatterns = [
     path('auth/register', views.register, name='register'),
     path('auth/login', views.login, name='login'),
+    path('metrics', views.metrics, name='metrics'),
     path('sweets', views.SweetListCreateView.as_view(), name='sweet-list-create'),
     path('sweets/search', views.SweetSearchView.as_view(), name='sweet-search'),
+    path('sweets/suggest', views.suggest_sweets, name='sweet-suggest'),
+    path('sweets/cache/stats', views.catalog_cache_stats, name='sweet-cache-stats'),
+    path('sweets/stats', views.sales_statistics, name='sweet-stats'),
+    path('sweets/export', views.export_sweets, name='sweet-export'),
+    path('sweets/import', views.import_sweets, name='sweet-import'),
+    path('sweets/changes', views.sweet_changes, name='sweet-changes'),
+    path('sweets/stream', views.stock_stream, name='sweet-stream'),
+    path('sweets/bulk/price', views.bulk_reprice, name='sweet-bulk-price'),
+    path('sweets/bulk/restock', views.bulk_restock, name='sweet-bulk-restock'),
+    path('sweets/checkout', views.checkout, name='sweet-checkout'),
     path('sweets/<int:pk>', views.SweetDetailView.as_view(), name='sweet-detail'),
     path('sweets/<int:pk>/purchase', views.purchase_sweet, name='sweet-purchase'),
+    path('sweets/<int:pk>/reserve', views.reserve_sweet, name='sweet-reserve'),
     path('sweets/<int:pk>/restock', views.restock_sweet, name='sweet-restock'),
+    path('sweets/<int:pk>/image', views.upload_sweet_image, name='sweet-image'),
+    path('reservations/<int:pk>', views.cancel_reservation, name='reservation-cancel'),
+    path('reservations/<int:pk>/purchase', views.purchase_reservation, name='reservation-purchase'),
+    path('media/<path:name>', views.sweet_image_file, name='sweet-image-file'),
 ]
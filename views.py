@@ -1,27 +1,68 @@
 from rest_framework import status, generics
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (
+    api_view, authentication_classes, parser_classes, permission_classes, renderer_classes
+)
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth import authenticate
+from django.http import FileResponse, Http404, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import require_safe
+from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 from decimal import Decimal
+from functools import partial
+import io
 
-from .models import Sweet
+from .models import MAX_PRICE, InventoryEvent, SalesRollup, Sweet
 from .serializers import (
-    UserRegistrationSerializer, UserSerializer, SweetSerializer,
-    PurchaseSerializer, RestockSerializer
+    UserRegistrationSerializer, UserSerializer, SweetSerializer, SweetValuesSerializer,
+    PurchaseSerializer, CheckoutLineSerializer, RestockSerializer, MassRestockSerializer, RepriceSerializer,
+    ReservationSerializer
 )
 from .permissions import IsAdminUser, IsAdminOrReadOnly
+from .pagination import KeysetPagination
+from .parsers import API_PARSERS
+from .renderers import API_RENDERERS, ORJSONRenderer
+from .search import filter_sweets
+from .facets import parse_facets, sweet_facets
+from .suggest import DEFAULT_LIMIT as SUGGEST_LIMIT, MAX_LIMIT as MAX_SUGGEST_LIMIT, suggest_index
+from .images import (
+    NAME_RE, ImageError, ImageSupportMissing, content_type, image_storage, read_upload, upload_image, variant_urls
+)
+from .caching import CachedCatalogMixin, catalog_cache
+from .authentication import StatelessJWTAuthentication, SweetShopRefreshToken
+from .instrumentation import latency, timed
+from .hashing import HashingBusy, authenticate_user
+from .idempotency import idempotent
+from .reservations import cancel, claim, reserve
+from .importers import ROW_READERS, SweetImporter
+from .exporters import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, buffered, gzip_stream
+from .ledger import STATS_GROUPS, STATS_WINDOWS, parse_timestamp, record_stock_changes, sales_stats
+from .feed import FEED_LIMIT, MAX_FEED_LIMIT, EventStreamRenderer, broadcaster, change_feed
+
+
+def hashing_busy():
+    return Response(
+        {'error': 'Too many sign-ins in progress, try again shortly'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': '1'}
+    )
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
 def register(request):
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
-        user = serializer.save()
-        refresh = RefreshToken.for_user(user)
+        try:
+            user = serializer.save()
+        except HashingBusy:
+            return hashing_busy()
+        refresh = SweetShopRefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'tokens': {
@@ -34,6 +75,8 @@ def register(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
 def login(request):
     username = request.data.get('username')
     password = request.data.get('password')
@@ -44,9 +87,12 @@ def login(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    user = authenticate(username=username, password=password)
+    try:
+        user = authenticate_user(username, password)
+    except HashingBusy:
+        return hashing_busy()
     if user:
-        refresh = RefreshToken.for_user(user)
+        refresh = SweetShopRefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'tokens': {
@@ -60,92 +106,593 @@ def login(request):
     )
 
 
-class SweetListCreateView(generics.ListCreateAPIView):
+class SweetValuesMixin:
+    # GETs read plain rows with values(), narrowed to the ?fields= projection
+    # plus whatever the paginator orders by, and render them with
+    # SweetValuesSerializer instead of building model instances.
+    def get_requested_fields(self):
+        return SweetValuesSerializer.parse_fields(self.request.query_params.get('fields'))
+
+    def list(self, request, *args, **kwargs):
+        fields = self.get_requested_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        # Paginators without a keyset ordering (or no paginator at all) page
+        # by the model's default ordering.
+        ordering = (getattr(self, 'keyset_ordering', None) or getattr(self.pagination_class, 'ordering', None)
+                    or queryset.model._meta.ordering)
+        serializer = SweetValuesSerializer(fields)
+        rows = serializer.values(queryset, *(field.lstrip('-') for field in ordering))
+        page = self.paginate_queryset(rows)
+        with timed('serialize'):
+            data = serializer.many(rows if page is None else page)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = SweetValuesSerializer(self.get_requested_fields())
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        row = get_object_or_404(queryset, **{self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]})
+        self.check_object_permissions(request, row)
+        with timed('serialize'):
+            data = serializer.to_representation(row)
+        return Response(data)
+
+
+class SweetListCreateView(CachedCatalogMixin, SweetValuesMixin, generics.ListCreateAPIView):
     queryset = Sweet.objects.all()
     serializer_class = SweetSerializer
+    authentication_classes = [StatelessJWTAuthentication]
+    renderer_classes = API_RENDERERS
+    parser_classes = API_PARSERS
     permission_classes = [IsAuthenticated, IsAdminOrReadOnly]
+    pagination_class = KeysetPagination
+    cache_scope = 'list'
 
 
-class SweetSearchView(generics.ListAPIView):
+class SweetSearchView(CachedCatalogMixin, SweetValuesMixin, generics.ListAPIView):
     serializer_class = SweetSerializer
+    pagination_class = KeysetPagination
+    cache_scope = 'search'
+    authentication_classes = [StatelessJWTAuthentication]
+    renderer_classes = API_RENDERERS
+    parser_classes = API_PARSERS
     # Allow unauthenticated users to search the catalog
     permission_classes = [AllowAny]
 
     def get_queryset(self):
-        queryset = Sweet.objects.all()
-        name = self.request.query_params.get('name')
-        category = self.request.query_params.get('category')
-        min_price = self.request.query_params.get('min_price')
-        max_price = self.request.query_params.get('max_price')
+        if self.request.query_params.get('q'):
+            self.keyset_ordering = ('search_rank', 'id')
+        return filter_sweets(Sweet.objects.all(), self.request.query_params)
 
-        if name:
-            queryset = queryset.filter(name__icontains=name)
-        if category:
-            queryset = queryset.filter(category=category)
-        if min_price:
-            queryset = queryset.filter(price__gte=Decimal(min_price))
-        if max_price:
-            queryset = queryset.filter(price__lte=Decimal(max_price))
+    def list(self, request, *args, **kwargs):
+        facets = parse_facets(request.query_params.get('facets'))
+        response = super().list(request, *args, **kwargs)
+        if facets:
+            response.data['facets'] = sweet_facets(request.query_params, facets)
+        return response
 
-        return queryset
 
-
-class SweetDetailView(generics.RetrieveUpdateDestroyAPIView):
+class SweetDetailView(CachedCatalogMixin, SweetValuesMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Sweet.objects.all()
     serializer_class = SweetSerializer
+    authentication_classes = [StatelessJWTAuthentication]
+    renderer_classes = API_RENDERERS
+    parser_classes = API_PARSERS
     permission_classes = [IsAuthenticated, IsAdminOrReadOnly]
+    cache_scope = 'detail'
 
 
 @api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+@idempotent('purchase')
 def purchase_sweet(request, pk):
-    try:
-        sweet = Sweet.objects.get(pk=pk)
-    except Sweet.DoesNotExist:
+    serializer = PurchaseSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    quantity = serializer.validated_data.get('quantity', 1)
+
+    with transaction.atomic():
+        purchased = Sweet.objects.decrement_stock(pk, quantity)
+        if purchased:
+            sweet = Sweet.objects.get(pk=pk)
+            record_stock_changes([(sweet, -quantity)], InventoryEvent.PURCHASE, request.user.id)
+            catalog_cache.invalidate()
+            transaction.on_commit(partial(broadcaster.publish_stock, sweet))
+
+    if not purchased:
+        sweet = Sweet.objects.filter(pk=pk).only('quantity', 'reserved', 'shard_count').first()
+        if sweet is None:
+            return Response(
+                {'error': 'Sweet not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
         return Response(
-            {'error': 'Sweet not found'},
+            {'error': f'Not enough stock. Available: {sweet.available_quantity}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    with timed('serialize'):
+        data = SweetSerializer(sweet).data
+    return Response({
+        'message': f'Successfully purchased {quantity} {sweet.name}(s)',
+        'sweet': data
+    })
+
+
+@api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+def checkout(request):
+    serializer = CheckoutLineSerializer(data=request.data, many=True, allow_empty=False)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    quantities = {}
+    for line in serializer.validated_data:
+        quantities[line['id']] = quantities.get(line['id'], 0) + line['quantity']
+
+    sweets = Sweet.objects.in_bulk(list(quantities))
+    missing = [pk for pk in quantities if pk not in sweets]
+    if missing:
+        return Response(
+            {'error': 'Sweet not found', 'ids': missing},
             status=status.HTTP_404_NOT_FOUND
         )
 
+    available = {pk: sweet.available_quantity for pk, sweet in sweets.items()}
+    short = {pk: available[pk] for pk, quantity in quantities.items()
+             if available[pk] < quantity}
+    if not short:
+        with transaction.atomic():
+            applied = Sweet.objects.decrement_stock_many(quantities) == len(quantities)
+            if applied:
+                catalog_cache.invalidate()
+                sweets = Sweet.objects.in_bulk(list(quantities))
+                record_stock_changes([(sweets[pk], -quantity) for pk, quantity in quantities.items()],
+                                     InventoryEvent.PURCHASE, request.user.id)
+                for sweet in sweets.values():
+                    transaction.on_commit(partial(broadcaster.publish_stock, sweet))
+            else:
+                # Another buyer got there first; undo the lines that applied.
+                transaction.set_rollback(True)
+        if not applied:
+            current = dict(Sweet.objects.filter(pk__in=quantities).with_stock().values_list('pk', 'available'))
+            short = {pk: current.get(pk, 0) for pk, quantity in quantities.items()
+                     if current.get(pk, 0) < quantity}
+
+    if short:
+        return Response(
+            {'error': 'Not enough stock', 'available': short},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    ordered = [sweets[pk] for pk in quantities]
+    total = sum((sweet.price * quantities[sweet.pk] for sweet in ordered), Decimal('0'))
+    with timed('serialize'):
+        data = SweetSerializer(ordered, many=True).data
+    return Response({
+        'message': f'Successfully purchased {sum(quantities.values())} item(s)',
+        'total': f'{total:.2f}',
+        'sweets': data
+    })
+
+
+@api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+@idempotent('reserve')
+def reserve_sweet(request, pk):
     serializer = PurchaseSerializer(data=request.data)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    quantity = serializer.validated_data.get('quantity', 1)
-
-    if sweet.quantity < quantity:
+    reservation = reserve(pk, request.user.id, serializer.validated_data.get('quantity', 1))
+    sweet = Sweet.objects.filter(pk=pk).first()
+    if sweet is None:
+        return Response(
+            {'error': 'Sweet not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    if reservation is None:
+        if sweet.shard_count:
+            return Response(
+                {'error': 'This sweet cannot be reserved'},
+                status=status.HTTP_409_CONFLICT
+            )
         return Response(
-            {'error': f'Not enough stock. Available: {sweet.quantity}'},
+            {'error': f'Not enough stock. Available: {sweet.available_quantity}'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    sweet.quantity -= quantity
-    sweet.save()
+    transaction.on_commit(partial(broadcaster.publish_stock, sweet))
     return Response({
-        'message': f'Successfully purchased {quantity} {sweet.name}(s)',
+        'reservation': ReservationSerializer(reservation).data,
         'sweet': SweetSerializer(sweet).data
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+@idempotent('reservation-purchase')
+def purchase_reservation(request, pk):
+    with transaction.atomic():
+        reservation = claim(pk, request.user.id)
+        if reservation is None:
+            return Response(
+                {'error': 'Reservation not found or expired'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        quantity = reservation.quantity
+        purchased = Sweet.objects.take_reserved(reservation.sweet_id, quantity)
+        if purchased:
+            sweet = Sweet.objects.get(pk=reservation.sweet_id)
+            record_stock_changes([(sweet, -quantity)], InventoryEvent.PURCHASE, request.user.id)
+        else:
+            # Stock was edited down below the holds on it; give this one back.
+            Sweet.objects.release_reserved({reservation.sweet_id: quantity})
+            sweet = Sweet.objects.get(pk=reservation.sweet_id)
+        catalog_cache.invalidate()
+        transaction.on_commit(partial(broadcaster.publish_stock, sweet))
+
+    if not purchased:
+        return Response(
+            {'error': f'Not enough stock. Available: {sweet.available_quantity}'},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    with timed('serialize'):
+        data = SweetSerializer(sweet).data
+    return Response({
+        'message': f'Successfully purchased {quantity} {sweet.name}(s)',
+        'sweet': data
     })
 
 
+@api_view(['DELETE'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes(API_RENDERERS)
+def cancel_reservation(request, pk):
+    reservation = cancel(pk, request.user.id)
+    if reservation is None:
+        return Response(
+            {'error': 'Reservation not found or expired'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    sweet = Sweet.objects.filter(pk=reservation.sweet_id).first()
+    if sweet is not None:
+        transaction.on_commit(partial(broadcaster.publish_stock, sweet))
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 @api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
 @permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+@idempotent('restock')
 def restock_sweet(request, pk):
-    try:
-        sweet = Sweet.objects.get(pk=pk)
-    except Sweet.DoesNotExist:
+    serializer = RestockSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    quantity = serializer.validated_data['quantity']
+
+    with transaction.atomic():
+        restocked = Sweet.objects.increment_stock(pk, quantity)
+        if restocked:
+            sweet = Sweet.objects.get(pk=pk)
+            record_stock_changes([(sweet, quantity)], InventoryEvent.RESTOCK, request.user.id)
+            catalog_cache.invalidate()
+            transaction.on_commit(partial(broadcaster.publish_stock, sweet))
+
+    if not restocked:
         return Response(
             {'error': 'Sweet not found'},
             status=status.HTTP_404_NOT_FOUND
         )
 
-    serializer = RestockSerializer(data=request.data)
+    with timed('serialize'):
+        data = SweetSerializer(sweet).data
+    return Response({
+        'message': f'Successfully restocked {quantity} {sweet.name}(s)',
+        'sweet': data
+    })
+
+
+@api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+@idempotent('bulk-price')
+def bulk_reprice(request):
+    # Applies to every sweet matching the search filters in the query string.
+    serializer = RepriceSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    percent = serializer.validated_data.get('percent')
+    amount = serializer.validated_data.get('amount')
+    sweets = filter_sweets(Sweet.objects.all(), request.query_params)
+
+    if amount is not None and amount < 0:
+        negative = sweets.filter(price__lt=-amount).count()
+        if negative:
+            return Response(
+                {'error': f'This would make the price of {negative} sweet(s) negative'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    too_high = sweets.reprice_overflows(percent, amount)
+    if too_high:
+        return Response(
+            {'error': f'This would make the price of {too_high} sweet(s) higher than {MAX_PRICE}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if serializer.validated_data['dry_run']:
+        return Response({'dry_run': True, 'matched': sweets.count()})
+
+    with transaction.atomic():
+        updated = sweets.reprice(percent, amount)
+        if updated:
+            catalog_cache.invalidate()
+    return Response({'dry_run': False, 'updated': updated})
+
+
+@api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+@idempotent('bulk-restock')
+def bulk_restock(request):
+    serializer = MassRestockSerializer(data=request.data)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     quantity = serializer.validated_data['quantity']
-    sweet.quantity += quantity
-    sweet.save()
+    sweets = filter_sweets(Sweet.objects.all(), request.query_params)
+
+    if serializer.validated_data['dry_run']:
+        return Response({'dry_run': True, 'matched': sweets.count()})
+
+    with transaction.atomic():
+        restocked = list(sweets.only('pk', 'category', 'price'))
+        updated = sweets.increment_stock_all(quantity)
+        if updated:
+            record_stock_changes([(sweet, quantity) for sweet in restocked],
+                                 InventoryEvent.RESTOCK, request.user.id)
+            catalog_cache.invalidate()
+            transaction.on_commit(partial(broadcaster.publish_stock_many, sweets))
+    return Response({'dry_run': False, 'updated': updated})
+
+
+@api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+def import_sweets(request):
+    # The body is read straight off the request stream, chunk by chunk, so
+    # request.data (which would buffer the whole payload) is never touched.
+    read_rows = ROW_READERS.get(request.content_type.split(';')[0].strip())
+    if read_rows is None:
+        return Response(
+            {'error': f"Unsupported content type. Use one of: {', '.join(ROW_READERS)}"},
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+    mode = request.query_params.get('mode', 'upsert')
+    if mode not in ('upsert', 'restock'):
+        return Response(
+            {'error': 'mode must be "upsert" or "restock"'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    importer = SweetImporter(mode=mode, user_id=request.user.id).run(read_rows(request._request))
+    catalog_cache.invalidate()
+    suggest_index.invalidate()
+    return Response(importer.summary())
+
+
+@api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes(API_RENDERERS)
+def export_sweets(request):
+    output = request.query_params.get('output', 'ndjson')
+    if output not in EXPORT_FORMATS:
+        return Response(
+            {'error': f"output must be one of: {', '.join(EXPORT_FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    render, content_type = EXPORT_FORMATS[output]
+
+    serializer = SweetValuesSerializer(SweetValuesSerializer.parse_fields(request.query_params.get('fields')))
+    queryset = filter_sweets(Sweet.objects.all(), request.query_params)
+    rows = serializer.values(queryset.order_by('id')).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    stream = buffered(render(rows, serializer))
+
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    if compress:
+        stream = gzip_stream(stream)
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="sweets.{output}"'
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+@api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([AllowAny])
+@renderer_classes(API_RENDERERS)
+def suggest_sweets(request):
+    # Served from the in-process prefix index: no database query per keystroke.
+    try:
+        limit = min(int(request.query_params.get('limit', SUGGEST_LIMIT)), MAX_SUGGEST_LIMIT)
+    except ValueError:
+        limit = SUGGEST_LIMIT
+    results = suggest_index.suggest(
+        request.query_params.get('prefix', ''),
+        limit=max(limit, 1),
+        category=request.query_params.get('category'),
+    )
+    return Response({'results': results})
+
+
+@api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes(API_RENDERERS)
+def sweet_changes(request):
+    try:
+        limit = min(int(request.query_params.get('limit', FEED_LIMIT)), MAX_FEED_LIMIT)
+    except ValueError:
+        limit = FEED_LIMIT
+    if limit < 1:
+        limit = FEED_LIMIT
+    fields = SweetValuesSerializer.parse_fields(request.query_params.get('fields'))
+    return Response(change_feed(request.query_params.get('since'), limit, fields))
+
+
+@api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes([ORJSONRenderer, EventStreamRenderer])
+def stock_stream(request):
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        return Response(
+            {'error': 'Too many stream subscribers, try again later'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': '5'}
+        )
+    response = StreamingHttpResponse(broadcaster.stream(subscriber), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+def sales_statistics(request):
+    params = request.query_params
+    period = params.get('period', SalesRollup.DAY)
+    group = params.get('group', 'category')
+    if period not in STATS_WINDOWS or group not in STATS_GROUPS:
+        return Response(
+            {'error': f"period must be one of: {', '.join(STATS_WINDOWS)}; "
+                      f"group must be one of: {', '.join(STATS_GROUPS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        until = parse_timestamp(params.get('until')) or timezone.now()
+        since = parse_timestamp(params.get('since')) or until - STATS_WINDOWS[period]
+    except ValueError:
+        return Response(
+            {'error': 'since and until must be ISO 8601 dates or datetimes'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    key = params.get('sweet' if group == 'sweet' else 'category')
+    if key is not None and group == 'sweet':
+        try:
+            key = int(key)
+        except ValueError:
+            return Response(
+                {'error': 'sweet must be a sweet id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
     return Response({
-        'message': f'Successfully restocked {quantity} {sweet.name}(s)',
-        'sweet': SweetSerializer(sweet).data
+        'period': period,
+        'group': group,
+        'since': since,
+        'until': until,
+        **sales_stats(period, group, since, until, key),
     })
+
+
+@api_view(['POST'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+@parser_classes(API_PARSERS)
+def upload_sweet_image(request, pk):
+    if not Sweet.objects.filter(pk=pk).exists():
+        return Response(
+            {'error': 'Sweet not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    # Either a multipart form with an "image" file or the raw image bytes.
+    if request.content_type.startswith('multipart/'):
+        upload = request.FILES.get('image')
+        if upload is None:
+            return Response(
+                {'error': 'Attach the file as "image"'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    else:
+        # Streamed, so the image limit applies rather than
+        # DATA_UPLOAD_MAX_MEMORY_SIZE; an empty body has no stream.
+        upload = request.stream or io.BytesIO()
+
+    try:
+        digest, ready = upload_image(pk, read_upload(upload))
+    except ImageSupportMissing as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    except ImageError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(
+        {'hash': digest, 'ready': ready, 'images': variant_urls(digest)},
+        status=status.HTTP_200_OK if ready else status.HTTP_202_ACCEPTED
+    )
+
+
+@require_safe
+def sweet_image_file(request, name):
+    # Variant names embed the content hash and the size, so a name's bytes
+    # never change and browsers and CDNs may keep them for good.
+    if not NAME_RE.match(name):
+        raise Http404
+    headers = {
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'ETag': quote_etag(name.rsplit('/', 1)[-1]),
+    }
+    if headers['ETag'] in parse_etags(request.headers.get('If-None-Match', '')):
+        return HttpResponseNotModified(headers=headers)
+    try:
+        file = image_storage().open(name)
+    except FileNotFoundError:
+        raise Http404
+    return FileResponse(file, content_type=content_type(name), headers=headers)
+
+
+@api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+def catalog_cache_stats(request):
+    return Response(catalog_cache.stats())
+
+
+@api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+@renderer_classes(API_RENDERERS)
+def metrics(request):
+    return Response({'latency': latency.snapshot()})